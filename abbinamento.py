@@ -0,0 +1,136 @@
+"""Assegnazione a costo minimo (algoritmo ungherese, Kuhn-Munkres) e
+flusso a costo minimo (cammini minimi successivi).
+
+Puro Python, senza dipendenze: le matrici della Gestione Assenze sono
+piccole (poche decine di classi scoperte nella stessa ora per le colonne
+dei candidati utili), quindi O(n²·m) resta nell'ordine dei millisecondi.
+Il flusso serve alla pianificazione dell'intera giornata, dove oltre a
+"un docente per classe" ci sono capacità per docente (massimo giornaliero).
+"""
+import heapq
+
+INFINITO = float("inf")
+
+
+def assegnazione_minima(costi):
+    """Assegna a ogni riga una colonna diversa minimizzando la somma dei costi.
+
+    `costi` è una lista di n righe, ognuna con m >= n costi (INFINITO se
+    l'abbinamento non è ammesso; ogni riga deve avere almeno m colonne
+    ammesse in comune con le altre perché esista una soluzione, es. colonne
+    "fittizie" a costo finito). Restituisce la lista delle colonne scelte,
+    una per riga."""
+    n = len(costi)
+    if n == 0:
+        return []
+    m = len(costi[0])
+    if m < n:
+        raise ValueError("servono almeno tante colonne quante righe")
+
+    # Potenziali u (righe) e v (colonne), p[j] = riga assegnata alla colonna j
+    # (indici da 1, la colonna 0 è la radice fittizia dei cammini aumentanti)
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    p = [0] * (m + 1)
+    via = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minimi = [INFINITO] * (m + 1)
+        usate = [False] * (m + 1)
+        while True:
+            usate[j0] = True
+            i0 = p[j0]
+            riga = costi[i0 - 1]
+            delta, j1 = INFINITO, 0
+            for j in range(1, m + 1):
+                if usate[j]:
+                    continue
+                ridotto = riga[j - 1] - u[i0] - v[j]
+                if ridotto < minimi[j]:
+                    minimi[j] = ridotto
+                    via[j] = j0
+                if minimi[j] < delta:
+                    delta, j1 = minimi[j], j
+            if delta == INFINITO:
+                raise ValueError("nessuna assegnazione ammessa per tutte le righe")
+            for j in range(m + 1):
+                if usate[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minimi[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # risale il cammino aumentante scambiando le assegnazioni
+        while j0:
+            j1 = via[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    scelte = [0] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            scelte[p[j] - 1] = j - 1
+    return scelte
+
+
+def flusso_costo_minimo(n_nodi, archi, sorgente, pozzo, quantita):
+    """Invia `quantita` unità da `sorgente` a `pozzo` al costo minimo.
+
+    `archi` è una lista di (da, a, capacita, costo) con costi >= 0 e nodi
+    numerati da 0 a n_nodi-1. Cammini minimi successivi con Dijkstra sui
+    costi ridotti (potenziali di Johnson). Restituisce la lista del flusso
+    su ogni arco, nello stesso ordine di `archi`; se il pozzo non è
+    raggiungibile solleva ValueError."""
+    # grafo residuo: per ogni arco il suo inverso, con indice pari/dispari
+    destinazioni, capacita, costi = [], [], []
+    uscenti = [[] for _ in range(n_nodi)]
+    for da, a, cap, costo in archi:
+        uscenti[da].append(len(destinazioni))
+        destinazioni.append(a); capacita.append(cap); costi.append(costo)
+        uscenti[a].append(len(destinazioni))
+        destinazioni.append(da); capacita.append(0); costi.append(-costo)
+
+    potenziali = [0] * n_nodi
+    inviato = 0
+    while inviato < quantita:
+        distanze = [INFINITO] * n_nodi
+        arco_entrante = [-1] * n_nodi
+        distanze[sorgente] = 0
+        coda = [(0, sorgente)]
+        while coda:
+            d, nodo = heapq.heappop(coda)
+            if d > distanze[nodo]:
+                continue
+            for e in uscenti[nodo]:
+                if capacita[e] <= 0:
+                    continue
+                arrivo = destinazioni[e]
+                nuova = d + costi[e] + potenziali[nodo] - potenziali[arrivo]
+                if nuova < distanze[arrivo]:
+                    distanze[arrivo] = nuova
+                    arco_entrante[arrivo] = e
+                    heapq.heappush(coda, (nuova, arrivo))
+        if distanze[pozzo] == INFINITO:
+            raise ValueError("flusso richiesto non realizzabile")
+        for nodo in range(n_nodi):
+            if distanze[nodo] < INFINITO:
+                potenziali[nodo] += distanze[nodo]
+
+        # capacità residua minima lungo il cammino
+        spinta, nodo = quantita - inviato, pozzo
+        while nodo != sorgente:
+            e = arco_entrante[nodo]
+            spinta = min(spinta, capacita[e])
+            nodo = destinazioni[e ^ 1]
+        nodo = pozzo
+        while nodo != sorgente:
+            e = arco_entrante[nodo]
+            capacita[e] -= spinta
+            capacita[e ^ 1] += spinta
+            nodo = destinazioni[e ^ 1]
+        inviato += spinta
+
+    return [capacita[2 * i + 1] for i in range(len(archi))]
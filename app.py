@@ -1,23 +1,38 @@
 import streamlit as st
 import pandas as pd
+import os
+import random
 import re
+import threading
+import time
 import io
 import json
 import zipfile
+from collections import Counter
+from typing import NamedTuple
 import html as html_lib
 import gspread
-import gspread_dataframe as gd
 from google.oauth2.service_account import Credentials
 from datetime import datetime
 
+import archivio_locale
+from client_google import ClientQuota
+from richieste_condivise import VoloSingolo
+from motore_sostituzioni import (
+    GIORNI_SETTIMANA, ORE_LEZIONE, LimitiGiornata, celle_per_classe, classi_per_docente,
+    compatta_orario, costruisci_indice, costruisci_pivot_docenti,
+    giorno_della_data, impegnati_altrove, normalizza_docente, pianifica_sostituzioni,
+    pulisci_etichetta, righe_sostegno, sostegni_in_servizio, verifica_conferma,
+    versione_orario, vista_classi, vista_classi_filtrata,
+)
+
 # =========================
 # VERSIONE APP
 # =========================
-# Aggiorna questo numero ad ogni modifica che carichi su entrambi i
-# deployment (Centrale e Castaldi): comparirà in piccolo nell'intestazione,
-# così puoi verificare a colpo d'occhio che l'aggiornamento sia arrivato
-# davvero su ciascuna delle due app (anche dopo un semplice "Reboot").
-APP_VERSION = "2.2"
+# Aggiorna questo numero ad ogni modifica che carichi: comparirà in piccolo
+# nell'intestazione, così puoi verificare a colpo d'occhio che
+# l'aggiornamento sia arrivato davvero (anche dopo un semplice "Reboot").
+APP_VERSION = "2.27"
 
 # =========================
 # CONFIGURAZIONE FILE / SHEETS
@@ -26,22 +41,46 @@ REQUIRED_COLUMNS    = ["Docente", "Giorno", "Ora", "Classe", "Tipo", "Escludi"]
 ORARIO_SHEET        = "orario"
 STORICO_SHEET       = "storico"
 ASSENZE_SHEET       = "assenze"
-GIORNI_SETTIMANA    = ["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì"]
-ORE_LEZIONE         = ["I", "II", "III", "IV", "V", "VI"]
+# GIORNI_SETTIMANA e ORE_LEZIONE sono definiti in motore_sostituzioni.py
 TIPI_LEZIONE        = ["Lezione", "Sostegno", "Altro"]
 
-# Il nome dello spreadsheet e il nome del plesso vengono letti dai secrets,
-# così lo stesso app.py può essere deployato due volte puntando a fogli diversi.
-# Aggiungi in Settings → Secrets di ciascun deployment su Streamlit Cloud:
-#   spreadsheet_name = "OrarioSostituzioni_Centrale"   (oppure _Castaldi)
-#   plesso_name      = "Plesso Centrale"               (oppure Castaldi)
+# Un solo processo serve tutti i plessi: ognuno ha il suo spreadsheet, la
+# sua copia locale e le sue cache, e la sessione sceglie il plesso con
+# ?plesso=<chiave> nell'URL (o dalla pagina di scelta). In Settings → Secrets:
+#   [plessi.centrale]
+#   spreadsheet_name = "OrarioSostituzioni_Centrale"
+#   plesso_name      = "Plesso Centrale"
+#   [plessi.castaldi]
+#   spreadsheet_name = "OrarioSostituzioni_Castaldi"
+#   plesso_name      = "Plesso Castaldi"
+# Resta valida anche la vecchia sezione [app] con un solo plesso.
+class Plesso(NamedTuple):
+    chiave: str            # nell'URL (?plesso=...) e nelle chiavi delle cache
+    nome: str
+    spreadsheet_name: str
+
+def _chiave_plesso(nome):
+    """"Plesso Centrale" → "centrale" (per la vecchia configurazione [app])."""
+    chiave = re.sub(r"[^a-z0-9]+", "_", nome.lower()).strip("_")
+    return re.sub(r"^plesso_", "", chiave) or "plesso"
+
+def plessi_configurati():
+    """{chiave: Plesso} dai secrets, nell'ordine in cui sono scritti."""
+    if "plessi" in st.secrets:
+        return {
+            chiave: Plesso(chiave, cfg["plesso_name"], cfg["spreadsheet_name"])
+            for chiave, cfg in st.secrets["plessi"].items()
+        }
+    nome = st.secrets["app"]["plesso_name"]
+    chiave = _chiave_plesso(nome)
+    return {chiave: Plesso(chiave, nome, st.secrets["app"]["spreadsheet_name"])}
+
 try:
-    SPREADSHEET_NAME = st.secrets["app"]["spreadsheet_name"]
-    PLESSO_NAME      = st.secrets["app"]["plesso_name"]
+    PLESSI = plessi_configurati()
 except KeyError:
     st.error(
         "Configurazione mancante nei secrets. Aggiungi in Settings → Secrets:\n\n"
-        "```\n[app]\nspreadsheet_name = \"OrarioSostituzioni_Centrale\"\n"
+        "```\n[plessi.centrale]\nspreadsheet_name = \"OrarioSostituzioni_Centrale\"\n"
         "plesso_name = \"Plesso Centrale\"\n```"
     )
     st.stop()
@@ -203,6 +242,65 @@ h3 { font-size: 1.2em; color: var(--dc-marrone); }
 </style>
 """, unsafe_allow_html=True)
 
+# =========================
+# SCELTA DEL PLESSO (per sessione)
+# =========================
+@st.cache_data(show_spinner=False)
+def intestazione_svg(chiave):
+    """SVG dell'intestazione del plesso (intestazione_plesso_<chiave>.svg),
+    letto una volta per plesso; None se il file non c'è."""
+    percorso = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"intestazione_plesso_{chiave}.svg")
+    try:
+        with open(percorso, encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+# dati di sessione legati al plesso: cambiando plesso non devono seguire l'utente
+CHIAVI_SESSIONE_PLESSO = (
+    "sostituzioni_confermate", "ore_assenti_confermate",
+    "data_sostituzione_tmp", "giorno_assente_tmp", "backup_richiesto",
+)
+
+def _apri_plesso(chiave):
+    if st.session_state.get("plesso") != chiave:
+        for k in CHIAVI_SESSIONE_PLESSO:
+            st.session_state.pop(k, None)
+    st.session_state["plesso"] = chiave
+
+def mostra_scelta_plesso(plessi):
+    st.header("🏫 Scegli il plesso")
+    for plesso in plessi.values():
+        svg = intestazione_svg(plesso.chiave)
+        if svg:
+            st.image(svg, use_container_width=True)
+        st.button(f"Apri {plesso.nome}", key=f"apri_{plesso.chiave}",
+                  on_click=_apri_plesso, args=(plesso.chiave,), type="primary")
+
+def scegli_plesso(plessi):
+    """Plesso della sessione: quello indicato in ?plesso=..., altrimenti
+    quello già scelto; con un solo plesso configurato non si chiede nulla.
+    La chiave resta nell'URL, così il link (e il 🔄) riaprono lo stesso plesso."""
+    if st.query_params.get("cambia_plesso") == "1":
+        st.query_params.clear()
+        st.session_state.pop("plesso", None)
+    richiesto = st.query_params.get("plesso")
+    if richiesto in plessi:
+        _apri_plesso(richiesto)
+    chiave = st.session_state.get("plesso")
+    if chiave not in plessi:
+        if len(plessi) > 1:
+            mostra_scelta_plesso(plessi)
+            st.stop()
+        chiave = next(iter(plessi))
+    st.query_params["plesso"] = chiave
+    return plessi[chiave]
+
+PLESSO = scegli_plesso(PLESSI)
+PLESSO_CHIAVE    = PLESSO.chiave
+SPREADSHEET_NAME = PLESSO.spreadsheet_name
+PLESSO_NAME      = PLESSO.nome
+
 # =========================
 # CLIENT GOOGLE DRIVE
 # =========================
@@ -212,99 +310,372 @@ SCOPE = [
     'https://www.googleapis.com/auth/spreadsheets'
 ]
 
+COLONNE_STORICO = ["data", "giorno", "docente", "ore"]
+COLONNE_ASSENZE = ["data", "giorno", "docente", "ora", "classe"]
+COLONNE_PER_FOGLIO = {
+    ORARIO_SHEET: REQUIRED_COLUMNS,
+    STORICO_SHEET: COLONNE_STORICO,
+    ASSENZE_SHEET: COLONNE_ASSENZE,
+}
 
 
 @st.cache_resource(show_spinner=False)
 def get_gdrive_client():
     gdrive_credentials = st.secrets["gdrive"]
     creds = Credentials.from_service_account_info(gdrive_credentials, scopes=SCOPE)
-    client = gspread.authorize(creds)
+    # ClientQuota: limite di quota, retry con backoff e contatori per metodo
+    client = gspread.authorize(creds, http_client=ClientQuota)
     return client
 
 @st.cache_resource(show_spinner=False)
-def get_spreadsheet():
-    """Apre (o crea) lo spreadsheet UNA SOLA VOLTA per la vita dell'app
-    (cache_resource), invece di rifare la ricerca per nome ad ogni rerun."""
-    client = get_gdrive_client()
-    try:
-        return client.open(SPREADSHEET_NAME)
-    except gspread.SpreadsheetNotFound:
-        # Creazione: l'utente dovrà eventualmente condividere il foglio
-        # con l'email del service account se vuole accedervi anche da browser.
-        return client.create(SPREADSHEET_NAME)
+def _handle_google(spreadsheet_name):
+    """Handle dello spreadsheet e dei suoi worksheet, condivisi da tutte le
+    sessioni e dai thread del processo: si risolvono UNA SOLA VOLTA (vedi
+    apri_fogli), invece di rifare la ricerca per nome ad ogni rerun."""
+    return {"lock": threading.Lock(), "sh": None, "fogli": {}}
+
+def crea_fogli(sh, nomi, id_occupati=()):
+    """Crea i fogli `nomi`, ognuno con la sua riga di intestazione, con UNA
+    sola batch_update (addSheet + updateCells). Gli sheetId si scelgono qui,
+    dopo quelli già usati, così le intestazioni possono riferirsi ai fogli
+    nella stessa richiesta. Restituisce {nome: worksheet}."""
+    primo_id = max(id_occupati, default=0) + 1
+    richieste = []
+    for i, nome in enumerate(nomi):
+        richieste.append({"addSheet": {"properties": {
+            "sheetId": primo_id + i, "title": nome,
+            "gridProperties": {"rowCount": 200, "columnCount": 20},
+        }}})
+        colonne = COLONNE_PER_FOGLIO.get(nome, [])
+        if colonne:
+            richieste.append({"updateCells": {
+                "start": {"sheetId": primo_id + i, "rowIndex": 0, "columnIndex": 0},
+                "rows": [{"values": [{"userEnteredValue": {"stringValue": c}} for c in colonne]}],
+                "fields": "userEnteredValue",
+            }})
+    risposta = sh.batch_update({"requests": richieste})
+    creati = [r["addSheet"]["properties"] for r in risposta.get("replies", []) if "addSheet" in r]
+    return {p["title"]: gspread.Worksheet(sh, p, sh.id, sh.client) for p in creati}
+
+def apri_fogli(handle, client, spreadsheet_name, fogli):
+    """(spreadsheet, {nome: worksheet}) per `fogli`. La prima volta apre (o
+    crea) lo spreadsheet e ne legge l'elenco dei fogli con UNA richiesta
+    'metadata', qualunque sia il numero dei fogli; quelli che mancano si
+    creano tutti insieme (vedi crea_fogli). Poi più nessuna chiamata
+    'metadata'. Non usa funzioni Streamlit, quindi si può chiamare anche
+    dai thread in background."""
+    with handle["lock"]:
+        if handle["sh"] is None:
+            try:
+                handle["sh"] = client.open(spreadsheet_name)
+            except gspread.SpreadsheetNotFound:
+                # Creazione: l'utente dovrà eventualmente condividere il foglio
+                # con l'email del service account se vuole accedervi anche da browser.
+                handle["sh"] = client.create(spreadsheet_name)
+        sh = handle["sh"]
+        if any(nome not in handle["fogli"] for nome in fogli):
+            # elenco aggiornato: un foglio può essere stato creato da un altro processo
+            handle["fogli"] = {ws.title: ws for ws in sh.worksheets()}
+            mancanti = [nome for nome in dict.fromkeys(fogli) if nome not in handle["fogli"]]
+            if mancanti:
+                handle["fogli"].update(crea_fogli(sh, mancanti, [ws.id for ws in handle["fogli"].values()]))
+        return sh, {nome: handle["fogli"][nome] for nome in fogli}
+
+def elenco_fogli(spreadsheet_name=None):
+    """{nome: worksheet} di tutti i fogli dello spreadsheet, riletto da
+    Google (una richiesta 'metadata'): serve dove conta sapere se un foglio
+    esiste adesso, es. gli archivi di fine anno."""
+    spreadsheet_name = spreadsheet_name or SPREADSHEET_NAME
+    handle = _handle_google(spreadsheet_name)
+    sh = apri_fogli(handle, get_gdrive_client(), spreadsheet_name, ())[0]
+    with handle["lock"]:
+        handle["fogli"] = {ws.title: ws for ws in sh.worksheets()}
+        return dict(handle["fogli"])
+
+def get_spreadsheet(spreadsheet_name=None):
+    """Lo spreadsheet del plesso della sessione (o quello indicato)."""
+    spreadsheet_name = spreadsheet_name or SPREADSHEET_NAME
+    return apri_fogli(_handle_google(spreadsheet_name), get_gdrive_client(), spreadsheet_name, ())[0]
 
-@st.cache_resource(show_spinner=False)
 def get_worksheet(sheet_name: str):
-    """Restituisce l'handle del worksheet, creandolo con l'header corretto
-    se non esiste. Cachato: una volta risolto l'handle, i rerun successivi
-    non fanno più alcuna chiamata 'metadata' a Google, solo letture/scritture
-    sui valori quando effettivamente richieste."""
-    headers_by_sheet = {
-        ORARIO_SHEET: REQUIRED_COLUMNS,
-        STORICO_SHEET: ["data", "giorno", "docente", "ore"],
-        ASSENZE_SHEET: ["data", "giorno", "docente", "ora", "classe"],
-    }
-    sh = get_spreadsheet()
-    try:
-        return sh.worksheet(sheet_name)
-    except gspread.WorksheetNotFound:
-        ws = sh.add_worksheet(title=sheet_name, rows="200", cols="20")
-        header_df = pd.DataFrame(columns=headers_by_sheet.get(sheet_name, []))
-        gd.set_with_dataframe(ws, header_df, include_index=False, include_column_header=True)
-        return ws
+    """Il worksheet `sheet_name` del plesso della sessione."""
+    _, fogli = apri_fogli(_handle_google(SPREADSHEET_NAME), get_gdrive_client(), SPREADSHEET_NAME, (sheet_name,))
+    return fogli[sheet_name]
 
 # =========================
 # INIZIALIZZAZIONE FOGLI (se mancanti creali con header corretti)
 # =========================
 def ensure_sheets_exist():
-    """Pre-carica gli handle dei worksheet. Grazie al cache_resource su
-    get_worksheet, dal secondo rerun in poi questa funzione non genera
-    alcuna chiamata di rete."""
-    for nome_foglio in (ORARIO_SHEET, STORICO_SHEET, ASSENZE_SHEET):
-        get_worksheet(nome_foglio)
+    """Pre-carica gli handle dei worksheet. Una volta risolti (vedi
+    apri_fogli) i rerun successivi non generano alcuna chiamata di rete."""
+    apri_fogli(
+        _handle_google(SPREADSHEET_NAME), get_gdrive_client(), SPREADSHEET_NAME,
+        (ORARIO_SHEET, STORICO_SHEET, ASSENZE_SHEET),
+    )
+
+# =========================
+# COPIA LOCALE (SQLite) DEI FOGLI
+# =========================
+# Le letture passano dalla copia locale (vedi archivio_locale.py): Google
+# viene interpellato solo al primo avvio, con il 🔄 e per inviare le scritture.
+def db_locale_di(spreadsheet_name):
+    """Percorso della copia locale dello spreadsheet di un plesso."""
+    return os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "dati_locali",
+        re.sub(r"[^\w.-]", "_", spreadsheet_name) + ".sqlite3",
+    )
+
+DB_LOCALE = db_locale_di(SPREADSHEET_NAME)
+
+@st.cache_resource(show_spinner=False)
+def prepara_archivio_locale(db_locale):
+    """Crea file e tabelle della copia locale una volta per processo e plesso."""
+    archivio_locale.inizializza(db_locale, COLONNE_PER_FOGLIO)
+    return db_locale
+
+@st.cache_resource(show_spinner=False)
+def letture_condivise():
+    """Single-flight di processo per le letture da Google: se più sessioni
+    chiedono lo stesso foglio insieme (scadenza dei dati, 🔄 premuto da più
+    persone) parte una sola richiesta e tutte ne condividono il risultato."""
+    return VoloSingolo()
+
+def leggi_fogli_google(fogli, sh=None, volo=None, spreadsheet_name=None):
+    """Legge i valori di più fogli con UNA sola richiesta (values:batchGet)
+    invece di una get_as_dataframe per foglio. Restituisce {foglio: griglia}.
+    `sh` e `volo` si passano esplicitamente quando si chiama da un thread;
+    `spreadsheet_name` per leggere lo spreadsheet di un altro plesso."""
+    spreadsheet_name = spreadsheet_name or SPREADSHEET_NAME
+    sh = sh or get_spreadsheet(spreadsheet_name)
+    volo = volo or letture_condivise()
+
+    def batch_get(chiavi):
+        nomi = [nome for _, nome in chiavi]
+        risposta = sh.values_batch_get(
+            ["'" + f.replace("'", "''") + "'" for f in nomi]
+        )
+        return {
+            chiave: intervallo.get("values", [])
+            for chiave, intervallo in zip(chiavi, risposta.get("valueRanges", []))
+        }
+
+    risultati = volo.esegui_gruppo([(spreadsheet_name, f) for f in fogli], batch_get)
+    return {nome: griglia for (_, nome), griglia in risultati.items()}
+
+def allinea_da_google(fogli=(ORARIO_SHEET, STORICO_SHEET, ASSENZE_SHEET)):
+    """Invia a Google le scritture locali in sospeso, poi rilegge tutti i
+    fogli in un'unica richiesta e aggiorna la copia locale (la cache delle
+    letture si invalida da sola, perché cambia la versione locale)."""
+    archivio_locale.sincronizza(DB_LOCALE, fogli, get_worksheet)
+    aggiornati = archivio_locale.aggiorna_da_google(DB_LOCALE, fogli, leggi_fogli_google)
+    stato = _stato_aggiornamento(PLESSO_CHIAVE)
+    stato["errore"], stato["riallineato"] = None, True
+    return aggiornati
+
+def allinea_al_primo_avvio():
+    """Se la copia locale non è mai stata riempita, scarica in un colpo
+    solo TUTTI i fogli mai allineati (non solo quello richiesto adesso):
+    orario, storico e assenze arrivano con una sola chiamata a Google."""
+    mai_allineati = [
+        f for f in COLONNE_PER_FOGLIO
+        if archivio_locale.ultimo_aggiornamento(DB_LOCALE, f) is None
+    ]
+    if mai_allineati:
+        allinea_da_google(mai_allineati)
+
+# =========================
+# AGGIORNAMENTO IN BACKGROUND (stale-while-revalidate)
+# =========================
+# Oltre questa età la copia locale viene riallineata da Google in un thread,
+# mentre l'app continua a mostrare subito i dati che ha già. La copia locale
+# resta su disco tra un riavvio e l'altro: un processo nuovo parte subito da
+# quella ("dati offline") e si riallinea in background al primo rerun.
+ETA_MASSIMA_DATI = 300  # secondi
+ATTESA_NUOVO_TENTATIVO = 60  # secondi tra due tentativi se Google non risponde
+
+@st.cache_resource(show_spinner=False)
+def _stato_aggiornamento(plesso):
+    """Stato condiviso da tutte le sessioni del processo sullo stesso
+    plesso: al massimo un thread di aggiornamento alla volta per plesso.
+    `riallineato` diventa True al primo allineamento riuscito del processo."""
+    return {"lock": threading.Lock(), "thread": None, "errore": None, "riallineato": False, "tentativo": 0.0}
+
+def eta_dati(db_locale=None):
+    """Secondi trascorsi dall'allineamento meno recente dei tre fogli
+    (None se la copia locale non è mai stata riempita)."""
+    db_locale = db_locale or DB_LOCALE
+    momenti = [archivio_locale.ultimo_aggiornamento(db_locale, f) for f in COLONNE_PER_FOGLIO]
+    if any(m is None for m in momenti):
+        return None
+    return time.time() - min(momenti)
+
+def aggiornamento_in_corso(plesso_chiave=None):
+    thread = _stato_aggiornamento(plesso_chiave or PLESSO_CHIAVE)["thread"]
+    return thread is not None and thread.is_alive()
+
+def dati_offline():
+    """True finché il processo lavora sulla copia locale senza essere
+    ancora riuscito a riallinearla con Google (avvio o Google irraggiungibile)."""
+    return eta_dati() is not None and not _stato_aggiornamento(PLESSO_CHIAVE)["riallineato"]
+
+def aggiorna_in_background(plesso=None):
+    """Se i dati locali sono più vecchi di ETA_MASSIMA_DATI, o il processo
+    non li ha ancora riallineati, avvia il riallineamento in un thread. La
+    nuova versione entra in un'unica transazione SQLite per foglio: chi
+    legge vede o i dati vecchi o quelli nuovi, mai a metà, e al rerun
+    successivo le cache si aggiornano da sole.
+
+    `plesso` è di norma quello della sessione; per un altro plesso (vedi
+    impegni_altri_plessi) si parte anche con la copia locale ancora vuota,
+    perché nessuno la riempie al primo avvio."""
+    plesso = plesso or PLESSO
+    db, nome = prepara_archivio_locale(db_locale_di(plesso.spreadsheet_name)), plesso.spreadsheet_name
+    eta = eta_dati(db)
+    stato = _stato_aggiornamento(plesso.chiave)
+    if eta is None and plesso.chiave == PLESSO_CHIAVE:
+        return
+    if eta is not None and stato["riallineato"] and eta < ETA_MASSIMA_DATI:
+        return
+    with stato["lock"]:
+        if aggiornamento_in_corso(plesso.chiave) or time.time() - stato["tentativo"] < ATTESA_NUOVO_TENTATIVO:
+            return
+        stato["tentativo"] = time.time()
+        # gli oggetti Streamlit (cache) si prendono qui, nel thread dello
+        # script; il thread di lavoro apre i fogli solo con apri_fogli
+        handle, client = _handle_google(nome), get_gdrive_client()
+        volo = letture_condivise()
+
+        def lavoro():
+            try:
+                sh, fogli_ws = apri_fogli(handle, client, nome, list(COLONNE_PER_FOGLIO))
+                archivio_locale.sincronizza(db, list(fogli_ws), fogli_ws.__getitem__)
+                archivio_locale.aggiorna_da_google(
+                    db, list(fogli_ws), lambda fogli: leggi_fogli_google(fogli, sh, volo, nome)
+                )
+                stato["errore"] = None
+                stato["riallineato"] = True
+            except Exception as e:
+                stato["errore"] = str(e)
+
+        stato["thread"] = threading.Thread(target=lavoro, name="aggiorna-da-google", daemon=True)
+        stato["thread"].start()
+
+# =========================
+# INVIO DIFFERITO A GOOGLE (write-behind)
+# =========================
+# Le righe da accodare (storico/assenze) restano nella copia locale finché
+# Google non le ha ricevute: un thread le invia tutte insieme, foglio per
+# foglio, e se Google non risponde riprova con attese crescenti.
+ATTESA_MIN_INVIO = 5      # secondi, primo ritentativo
+ATTESA_MAX_INVIO = 300    # secondi, tetto dell'attesa tra un tentativo e l'altro
+
+@st.cache_resource(show_spinner=False)
+def _stato_invio(plesso):
+    """Stato condiviso da tutte le sessioni: un solo thread di invio alla volta per plesso."""
+    return {"lock": threading.Lock(), "thread": None, "errore": None}
+
+def record_in_sospeso():
+    """Righe di storico e assenze salvate in locale e non ancora su Google."""
+    return sum(
+        archivio_locale.righe_in_sospeso(DB_LOCALE, f) for f in (STORICO_SHEET, ASSENZE_SHEET)
+    )
+
+def invia_in_background():
+    """Avvia (se non è già attivo) il thread che svuota la coda delle
+    scritture in sospeso di tutti i fogli. Il thread termina quando la coda
+    è vuota; il controllo finale e l'avvio avvengono sotto lo stesso lock,
+    così una riga accodata nel frattempo non resta mai senza chi la invia."""
+    stato = _stato_invio(PLESSO_CHIAVE)
+    with stato["lock"]:
+        if stato["thread"] is not None and stato["thread"].is_alive():
+            return
+        # oggetti Streamlit presi nel thread dello script (vedi aggiorna_in_background)
+        handle, client = _handle_google(SPREADSHEET_NAME), get_gdrive_client()
+        db, nome = DB_LOCALE, SPREADSHEET_NAME
+
+        def apri_foglio(foglio):
+            return apri_fogli(handle, client, nome, (foglio,))[1][foglio]
+
+        def lavoro():
+            tentativo = 0
+            while True:
+                with stato["lock"]:
+                    fogli = [f for f in COLONNE_PER_FOGLIO if archivio_locale.in_sospeso(db, f)]
+                    if not fogli:
+                        stato["thread"] = None
+                        return
+                try:
+                    archivio_locale.sincronizza(db, fogli, apri_foglio)
+                    stato["errore"] = None
+                    tentativo = 0
+                except Exception as e:
+                    stato["errore"] = str(e)
+                    time.sleep(random.uniform(
+                        ATTESA_MIN_INVIO, min(ATTESA_MAX_INVIO, ATTESA_MIN_INVIO * 2 ** tentativo)
+                    ))
+                    tentativo += 1
+
+        stato["thread"] = threading.Thread(target=lavoro, name="invia-a-google", daemon=True)
+        stato["thread"].start()
+
+def sincronizza_con_google(fogli):
+    """Invia a Google le scritture locali in sospeso. Se Google non risponde
+    i dati restano salvati in locale e verranno inviati al prossimo tentativo."""
+    try:
+        archivio_locale.sincronizza(DB_LOCALE, fogli, get_worksheet)
+        return True
+    except Exception as e:
+        st.warning(
+            f"Dati salvati sul server, ma l'invio a Google Sheets non è riuscito ({e}). "
+            "Verrà ritentato automaticamente."
+        )
+        return False
+
+def _valore_vero(v):
+    """Checkbox/testo del foglio → bool (TRUE/FALSE, VERO/FALSO, 1/0, sì/no)."""
+    return str(v).strip().upper() in ("TRUE", "VERO", "1", "SI", "SÌ", "X", "YES")
 
 # =========================
 # CARICAMENTO / SALVATAGGIO ORARIO
 # =========================
-@st.cache_data(ttl=300, show_spinner=False)
+@st.cache_data(show_spinner=False, max_entries=4)
+def _leggi_orario(db_locale, versione):
+    """Legge e normalizza l'orario dalla copia locale. (`db_locale`,
+    `versione`) è la chiave di cache: cambia ad ogni scrittura o
+    riallineamento, e ogni plesso ha la sua copia locale."""
+    df = archivio_locale.leggi(db_locale, ORARIO_SHEET)
+    # Google Sheets può portare True/False o stringhe
+    df["Escludi"] = df["Escludi"].map(_valore_vero).astype(bool)
+    for col in ["Tipo", "Docente", "Giorno", "Ora", "Classe"]:
+        df[col] = df[col].astype(str).str.strip().fillna("")
+    # mantieni solo le colonne richieste, in forma compatta (categoriali + is_sostegno)
+    return compatta_orario(df.loc[:, REQUIRED_COLUMNS])
+
 def carica_orario():
     try:
-        ws = get_worksheet(ORARIO_SHEET)
-        df = gd.get_as_dataframe(ws, evaluate_formulas=True, header=0)
-        # rimuovo colonne totalmente vuote
-        df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-        # riempio eventuali colonne mancanti con default
-        for col in REQUIRED_COLUMNS:
-            if col not in df.columns:
-                df[col] = ""
-        # drop rows completamente vuote
-        df = df.dropna(how='all').copy()
-        # normalizzazione tipi
-        if "Escludi" in df.columns:
-            # Google Sheets può portare True/False o stringhe
-            df["Escludi"] = df["Escludi"].replace({pd.NA: False, "": False}).astype(bool)
-        else:
-            df["Escludi"] = False
-        for col in ["Tipo", "Docente", "Giorno", "Ora", "Classe"]:
-            df[col] = df[col].astype(str).str.strip().fillna("")
-        # mantieni solo le colonne richieste
-        df = df.loc[:, REQUIRED_COLUMNS]
-        return df
+        allinea_al_primo_avvio()
+        return _leggi_orario(DB_LOCALE, archivio_locale.versione(DB_LOCALE, ORARIO_SHEET))
     except Exception as e:
         st.error(f"Errore nel caricamento dell'orario da Google Sheets: {e}")
         return pd.DataFrame(columns=REQUIRED_COLUMNS)
 
+def _righe_da_df(df):
+    """DataFrame → lista di righe di testo, celle vuote al posto di NaN/None."""
+    return df.astype(object).where(df.notna(), "").astype(str).values.tolist()
+
 def salva_orario(df):
     try:
-        ws = get_worksheet(ORARIO_SHEET)
         # assicurati che le colonne siano quelle giuste e in ordine
         df_to_save = df.copy()
         for col in REQUIRED_COLUMNS:
             if col not in df_to_save.columns:
                 df_to_save[col] = ""
         df_to_save = df_to_save[REQUIRED_COLUMNS]
-        gd.set_with_dataframe(ws, df_to_save, include_index=False, include_column_header=True)
-        carica_orario.clear()  # invalida la cache: i dati appena salvati saranno subito visibili
+        # prima in locale (i dati appena salvati sono subito visibili), poi su Google:
+        # la sincronizzazione invia solo le righe cambiate/aggiunte/tolte rispetto
+        # all'ultima versione letta dal foglio (vedi archivio_locale.calcola_differenze)
+        archivio_locale.sostituisci(DB_LOCALE, ORARIO_SHEET, _righe_da_df(df_to_save))
+        sincronizza_con_google([ORARIO_SHEET])
         return True
     except Exception as e:
         st.error(f"Errore nel salvataggio dell'orario su Google Sheets: {e}")
@@ -313,48 +684,85 @@ def salva_orario(df):
 # =========================
 # CARICAMENTO / SALVATAGGIO STATISTICHE (storico + assenze)
 # =========================
-@st.cache_data(ttl=300, show_spinner=False)
+@st.cache_data(show_spinner=False, max_entries=4)
+def _leggi_statistiche(db_locale, versione_storico, versione_assenze):
+    df_storico = archivio_locale.leggi(db_locale, STORICO_SHEET)
+    df_assenze = archivio_locale.leggi(db_locale, ASSENZE_SHEET)
+    # Normalizza nomi e tipi
+    if not df_storico.empty:
+        if "data" in df_storico.columns:
+            df_storico["data"] = pd.to_datetime(df_storico["data"], errors="coerce")
+            df_storico["data"] = df_storico["data"].dt.strftime("%Y-%m-%d")
+
+        if "ore" in df_storico.columns:
+            df_storico["ore"] = pd.to_numeric(df_storico["ore"], errors="coerce").fillna(0).astype(int)
+
+        for c in ["docente", "giorno"]:
+            if c in df_storico.columns:
+                df_storico[c] = df_storico[c].astype(str).str.strip().str.lower()
+    if not df_assenze.empty:
+        if "data" in df_assenze.columns:
+            df_assenze["data"] = pd.to_datetime(df_assenze["data"], errors="coerce")
+            df_assenze["data"] = df_assenze["data"].dt.strftime("%Y-%m-%d")
+        for c in ["docente", "giorno", "ora", "classe"]:
+            if c in df_assenze.columns:
+                df_assenze[c] = df_assenze[c].astype(str).str.strip()
+    # Se i fogli sono vuoti, restituisci DataFrame con le colonne attese
+    if df_storico.empty:
+        df_storico = pd.DataFrame(columns=COLONNE_STORICO)
+    if df_assenze.empty:
+        df_assenze = pd.DataFrame(columns=COLONNE_ASSENZE)
+    return df_storico, df_assenze
+
 def carica_statistiche():
     try:
-        ws_storico = get_worksheet(STORICO_SHEET)
-        ws_assenze = get_worksheet(ASSENZE_SHEET)
-        df_storico = gd.get_as_dataframe(ws_storico, header=0).dropna(how='all')
-        df_assenze = gd.get_as_dataframe(ws_assenze, header=0).dropna(how='all')
-        # Normalizza nomi e tipi
-        if not df_storico.empty:
-            if "data" in df_storico.columns:
-                df_storico["data"] = pd.to_datetime(df_storico["data"], errors="coerce")
-                df_storico["data"] = df_storico["data"].dt.strftime("%Y-%m-%d")
-
-            if "ore" in df_storico.columns:
-                df_storico["ore"] = pd.to_numeric(df_storico["ore"], errors="coerce").fillna(0).astype(int)
-
-            for c in ["docente", "giorno"]:
-                if c in df_storico.columns:
-                    df_storico[c] = df_storico[c].astype(str).str.strip().str.lower()
-        if not df_assenze.empty:
-            if "data" in df_assenze.columns:
-                df_assenze["data"] = pd.to_datetime(df_assenze["data"], errors="coerce")
-                df_assenze["data"] = df_assenze["data"].dt.strftime("%Y-%m-%d")
-            for c in ["docente", "giorno", "ora", "classe"]:
-                if c in df_assenze.columns:
-                    df_assenze[c] = df_assenze[c].astype(str).str.strip()
-        # Se i fogli sono vuoti, restituisci DataFrame con le colonne attese
-        if df_storico.empty:
-            df_storico = pd.DataFrame(columns=["data", "giorno", "docente", "ore"])
-        if df_assenze.empty:
-            df_assenze = pd.DataFrame(columns=["data", "giorno", "docente", "ora", "classe"])
-        return df_storico, df_assenze
+        allinea_al_primo_avvio()
+        return _leggi_statistiche(
+            DB_LOCALE,
+            archivio_locale.versione(DB_LOCALE, STORICO_SHEET),
+            archivio_locale.versione(DB_LOCALE, ASSENZE_SHEET),
+        )
     except Exception as e:
         st.error(f"Errore nel caricamento delle statistiche da Google Sheets: {e}")
-        return pd.DataFrame(columns=["data", "giorno", "docente", "ore"]), pd.DataFrame(columns=["data", "giorno", "docente", "ora", "classe"])
+        return pd.DataFrame(columns=COLONNE_STORICO), pd.DataFrame(columns=COLONNE_ASSENZE)
+
+
+# Ore di sostituzione già svolte per docente (nome in minuscolo, come nello
+# storico): servono al motore per proporre prima chi ne ha fatte meno.
+@st.cache_resource(show_spinner=False)
+def _stato_carico(plesso):
+    """Contatore condiviso da tutte le sessioni del plesso. `versione` è la versione
+    locale dello storico a cui corrisponde: se lo storico cambia per altre
+    vie (riallineamento da Google, azzeramento) si ricostruisce da capo."""
+    return {"lock": threading.Lock(), "versione": None, "ore": Counter()}
+
+def _ore_da_righe(righe):
+    """Counter {docente minuscolo: ore} da righe [data, giorno, docente, ore]."""
+    ore = Counter()
+    for _, _, docente, n in righe:
+        try:
+            n = float(str(n).strip().replace(",", "."))
+        except ValueError:
+            n = 0
+        ore[str(docente).strip().lower()] += int(n) if n == n else 0
+    return ore
+
+def carico_sostituzioni():
+    """Totale ore per docente. Di norma lo aggiorna salva_storico_assenze
+    riga per riga; la lettura completa dello storico avviene solo se la
+    versione locale non corrisponde più (prima volta, modifiche da Google)."""
+    stato = _stato_carico(PLESSO_CHIAVE)
+    with stato["lock"]:
+        versione = archivio_locale.versione(DB_LOCALE, STORICO_SHEET)
+        if stato["versione"] != versione:
+            storico = archivio_locale.leggi(DB_LOCALE, STORICO_SHEET)
+            stato["ore"] = _ore_da_righe(storico[COLONNE_STORICO].itertuples(index=False))
+            stato["versione"] = versione
+        return dict(stato["ore"])
 
 
 def salva_storico_assenze(data_sostituzione, giorno_assente, sostituzioni_df, ore_assenti):
     try:
-        ws_storico = get_worksheet(STORICO_SHEET)
-        ws_assenze = get_worksheet(ASSENZE_SHEET)
-
         # Filtra solo le sostituzioni effettive (esclude "Nessuno")
         sostituzioni_effettive = sostituzioni_df[
             sostituzioni_df["Sostituto"].notna() &
@@ -368,40 +776,42 @@ def salva_storico_assenze(data_sostituzione, giorno_assente, sostituzioni_df, or
             for _, row in sostituzioni_effettive.iterrows()
         ]
 
-        if storico_data:
-            ws_storico.append_rows(storico_data, value_input_option="USER_ENTERED")
-
         # Filtra le assenze effettive: includi solo le ore dove il docente è stato effettivamente sostituito
         ore_effettivamente_assenti = ore_assenti[
             ore_assenti["Ora"].isin(sostituzioni_effettive["Ora"])
         ].copy()
 
         assenze_data = [
-            [str(data_sostituzione), giorno_assente, row["Docente"], row["Ora"], row["Classe"]]
+            [str(data_sostituzione), giorno_assente, row["Docente"], str(row["Ora"]), row["Classe"]]
             for _, row in ore_effettivamente_assenti.iterrows()
         ]
 
-        if assenze_data:
-            ws_assenze.append_rows(assenze_data, value_input_option="USER_ENTERED")
-
-        carica_statistiche.clear()  # invalida la cache: storico/assenze aggiornati saranno subito visibili
-        return True
+        # in locale il salvataggio è definitivo (e subito visibile nelle
+        # statistiche); l'invio a Google avviene in background
+        stato = _stato_carico(PLESSO_CHIAVE)
+        with stato["lock"]:
+            versione_prima = archivio_locale.versione(DB_LOCALE, STORICO_SHEET)
+            archivio_locale.accoda(DB_LOCALE, STORICO_SHEET, storico_data)
+            if storico_data and stato["versione"] == versione_prima:
+                # aggiornamento incrementale del carico, senza rileggere lo storico
+                stato["ore"].update(_ore_da_righe(storico_data))
+                stato["versione"] = archivio_locale.versione(DB_LOCALE, STORICO_SHEET)
+        archivio_locale.accoda(DB_LOCALE, ASSENZE_SHEET, assenze_data)
     except Exception as e:
-        st.error(f"Errore nel salvataggio dei dati su Google Sheets: {e}")
+        st.error(f"Errore nel salvataggio delle assenze: {e}")
         return False
+    try:
+        invia_in_background()
+    except Exception as e:
+        st.warning(f"Dati salvati sul server, invio a Google Sheets non avviato ({e}): verrà ritentato.")
+    return True
 
 def clear_sheet_content(sheet_name):
     try:
-        ws = get_worksheet(sheet_name)
-        ws.clear()
-        if sheet_name == STORICO_SHEET:
-            ws.append_row(["data", "giorno", "docente", "ore"])
-        elif sheet_name == ASSENZE_SHEET:
-            ws.append_row(["data", "giorno", "docente", "ora", "classe"])
-        if sheet_name in (STORICO_SHEET, ASSENZE_SHEET):
-            carica_statistiche.clear()
-        elif sheet_name == ORARIO_SHEET:
-            carica_orario.clear()
+        # svuoto la copia locale: la sincronizzazione riscrive il foglio
+        # con la sola riga di intestazione
+        archivio_locale.sostituisci(DB_LOCALE, sheet_name, [])
+        archivio_locale.sincronizza(DB_LOCALE, [sheet_name], get_worksheet)
         return True
     except Exception as e:
         st.error(f"Errore nell'azzeramento del foglio {sheet_name}: {e}")
@@ -417,29 +827,47 @@ def archivia_anno_scolastico(anno: str):
             STORICO_SHEET: f"archivio_storico_{suffisso}",
             ASSENZE_SHEET: f"archivio_assenze_{suffisso}",
         }
-
-        for sheet_src, nome_dest in nomi_archivio.items():
-            # Controlla che il foglio archivio non esista già
-            try:
-                sh.worksheet(nome_dest)
+        # Controlla che i fogli archivio non esistano già: un solo elenco dei fogli
+        esistenti = elenco_fogli()
+        for nome_dest in nomi_archivio.values():
+            if nome_dest in esistenti:
                 st.error(f"Esiste già un archivio per l'anno {anno} ({nome_dest}). Scegli un anno diverso.")
                 return False
-            except gspread.WorksheetNotFound:
-                pass
-
-            # Leggi dati attivi
-            ws_src = get_worksheet(sheet_src)
-            dati = ws_src.get_all_values()  # lista di liste inclusa intestazione
-
-            # Crea foglio archivio e scrivi dati
-            ws_dest = sh.add_worksheet(title=nome_dest, rows=max(len(dati) + 10, 50), cols=10)
-            if dati:
-                ws_dest.update(values=dati, value_input_option="USER_ENTERED")
-
-        # Svuota i fogli attivi
-        clear_sheet_content(STORICO_SHEET)
-        clear_sheet_content(ASSENZE_SHEET)
-        carica_statistiche.clear()
+
+        def copia_e_svuota():
+            # Una sola batchUpdate: Google duplica i fogli dal suo lato (nessun
+            # download né ricaricamento delle celle) e li svuota, tenendo
+            # l'intestazione. Le richieste di una batchUpdate si applicano
+            # tutte o nessuna: niente archivi a metà se qualcosa va storto.
+            richieste = []
+            for i, (sheet_src, nome_dest) in enumerate(nomi_archivio.items()):
+                richieste.append({"duplicateSheet": {
+                    "sourceSheetId": get_worksheet(sheet_src).id,
+                    "newSheetName": nome_dest,
+                    "insertSheetIndex": len(esistenti) + i,
+                }})
+            for sheet_src in nomi_archivio:
+                id_foglio = get_worksheet(sheet_src).id
+                richieste.append({"updateCells": {
+                    "range": {"sheetId": id_foglio, "startRowIndex": 1},
+                    "fields": "userEnteredValue",
+                }})
+                richieste.append({"updateCells": {
+                    "start": {"sheetId": id_foglio, "rowIndex": 0, "columnIndex": 0},
+                    "rows": [{"values": [
+                        {"userEnteredValue": {"stringValue": c}} for c in COLONNE_PER_FOGLIO[sheet_src]
+                    ]}],
+                    "fields": "userEnteredValue",
+                }})
+            return sh.batch_update({"requests": richieste})
+
+        # prima si inviano le righe salvate in locale e non ancora inviate,
+        # così l'archivio le contiene; poi copia e azzeramento, senza riletture
+        risposta = archivio_locale.archivia_e_svuota(DB_LOCALE, list(nomi_archivio), get_worksheet, copia_e_svuota)
+        copiati = [r["duplicateSheet"]["properties"] for r in risposta.get("replies", []) if "duplicateSheet" in r]
+        handle = _handle_google(SPREADSHEET_NAME)
+        with handle["lock"]:
+            handle["fogli"].update({p["title"]: gspread.Worksheet(sh, p, sh.id, sh.client) for p in copiati})
         return True
     except Exception as e:
         st.error(f"Errore durante l'archiviazione: {e}")
@@ -448,31 +876,30 @@ def archivia_anno_scolastico(anno: str):
 # =========================
 # FUNZIONE PER IL BACKUP CORRETTA
 # =========================
+@st.cache_data(show_spinner=False, max_entries=2)
+def _zip_backup(db_locale, versione_orario, versione_storico, versione_assenze):
+    """ZIP dei tre fogli per una data versione dei dati: finché nessuno
+    scrive, i download successivi riusano lo stesso ZIP senza ricalcolarlo.
+    Ogni CSV viene scritto direttamente dentro la voce dello ZIP, senza
+    costruire prima la stringa intera in memoria."""
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED, False) as zip_file:
+        for nome_file, foglio in (("orario.csv", ORARIO_SHEET),
+                                  ("storico.csv", STORICO_SHEET),
+                                  ("assenze.csv", ASSENZE_SHEET)):
+            with io.TextIOWrapper(zip_file.open(nome_file, "w"), encoding="utf-8", newline="") as voce:
+                archivio_locale.leggi(db_locale, foglio).to_csv(voce, index=False)
+    return zip_buffer.getvalue()
+
 def create_backup():
     try:
-        # Esporta il foglio "orario" in CSV
-        ws_orario = get_worksheet(ORARIO_SHEET)
-        df_orario = gd.get_as_dataframe(ws_orario, evaluate_formulas=True, header=0).dropna(how='all')
-
-        # Esporta il foglio "storico" in CSV
-        ws_storico = get_worksheet(STORICO_SHEET)
-        df_storico = gd.get_as_dataframe(ws_storico, evaluate_formulas=True, header=0).dropna(how='all')
-
-        # Esporta il foglio "assenze" in CSV
-        ws_assenze = get_worksheet(ASSENZE_SHEET)
-        df_assenze = gd.get_as_dataframe(ws_assenze, evaluate_formulas=True, header=0).dropna(how='all')
-
-        # Comprimi i DataFrame in un file ZIP in memoria
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
-            # Aggiungi i file CSV al buffer
-            zip_file.writestr("orario.csv", df_orario.to_csv(index=False).encode('utf-8'))
-            zip_file.writestr("storico.csv", df_storico.to_csv(index=False).encode('utf-8'))
-            zip_file.writestr("assenze.csv", df_assenze.to_csv(index=False).encode('utf-8'))
-
-        # Restituisci il contenuto del file ZIP
-        zip_buffer.seek(0)
-        return zip_buffer
+        # I tre fogli arrivano dalla copia locale, già allineata a Google
+        # dall'ultimo caricamento: nessun nuovo download
+        allinea_al_primo_avvio()
+        return _zip_backup(DB_LOCALE, *(
+            archivio_locale.versione(DB_LOCALE, f)
+            for f in (ORARIO_SHEET, STORICO_SHEET, ASSENZE_SHEET)
+        ))
     except Exception as e:
         st.error(f"Errore durante la creazione del backup: {e}")
         return None
@@ -480,16 +907,6 @@ def create_backup():
 # =========================
 # UTILITA' PER DOWNLOAD e PIVOT
 # =========================
-def build_docente_tipo_map(df):
-    """Precalcola una mappa {docente: tipo} una sola volta, invece di
-    rifare un filtro su orario_df per ogni docente dentro i loop."""
-    if df.empty:
-        return {}
-    tmp = df[df["Tipo"].astype(str).str.strip() != ""]
-    if tmp.empty:
-        return {}
-    return tmp.groupby("Docente")["Tipo"].first().to_dict()
-
 def trova_conflitti_orario(df):
     """Ritorna le combinazioni (Docente, Giorno, Ora) che compaiono più di
     una volta in df, cioè un docente assegnato a due classi nella stessa ora."""
@@ -498,6 +915,91 @@ def trova_conflitti_orario(df):
     conteggi = df.groupby(["Docente", "Giorno", "Ora"]).size()
     return [idx for idx, n in conteggi.items() if n > 1 and idx[0].strip() != ""]
 
+# =========================
+# INDICE ORARIO PER SLOT (Giorno, Ora)
+# =========================
+@st.cache_resource(show_spinner=False, max_entries=4)
+def costruisci_indice_orario(_df, versione):
+    """Costruisce l'indice del motore UNA volta per versione dell'orario
+    (il parametro `versione` fa da chiave di cache, il DataFrame non viene
+    hashato). Vedi motore_sostituzioni.IndiceOrario."""
+    return costruisci_indice(_df)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def tabella_sostegni_in_servizio(_df, versione):
+    """(Giorno, Ora, Classe) → sostegni in classe, una volta per versione
+    dell'orario: la colonna delle ore scoperte è poi una sola merge."""
+    return sostegni_in_servizio(_df)
+
+# =========================
+# ORARIO DEGLI ALTRI PLESSI (docenti in comune)
+# =========================
+# Un docente libero qui può avere lezione nell'altro plesso: l'orario degli
+# altri plessi si legge dalla loro copia locale, che lo stesso processo
+# tiene allineata in background come quella del plesso della sessione.
+# Nessuna chiamata a Google mentre si disegna la pagina.
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _impegni_da_copie_locali(versioni):
+    """{docente normalizzato: {(giorno, ora): nome del plesso}} dagli orari
+    locali dei plessi in `versioni` ((chiave, versione dell'orario), ...):
+    si ricalcola solo quando uno di quegli orari cambia."""
+    impegni = {}
+    for chiave, _ in versioni:
+        altro = PLESSI[chiave]
+        orario = archivio_locale.leggi(db_locale_di(altro.spreadsheet_name), ORARIO_SHEET)
+        for docente, giorno, ora in zip(orario["Docente"], orario["Giorno"], orario["Ora"]):
+            docente = normalizza_docente(docente)
+            if docente:
+                impegni.setdefault(docente, {})[(giorno.strip(), ora.strip())] = altro.nome
+    return impegni
+
+def impegni_altri_plessi(plesso):
+    """Impegni dei docenti negli altri plessi (vedi _impegni_da_copie_locali),
+    la loro versione in `letto` (fa da chiave per le cache che ne dipendono)
+    e in `errori` i plessi il cui orario non è ancora mai stato letto. Le
+    copie locali vecchie o vuote si riallineano in background."""
+    versioni, errori = [], {}
+    for altro in PLESSI.values():
+        if altro.chiave == plesso:
+            continue
+        db = prepara_archivio_locale(db_locale_di(altro.spreadsheet_name))
+        try:
+            aggiorna_in_background(altro)
+        except Exception as e:
+            _stato_aggiornamento(altro.chiave)["errore"] = str(e)
+        if archivio_locale.ultimo_aggiornamento(db, ORARIO_SHEET) is None:
+            errori[altro.nome] = _stato_aggiornamento(altro.chiave)["errore"] or "lettura in corso"
+            continue
+        versioni.append((altro.chiave, archivio_locale.versione(db, ORARIO_SHEET)))
+    versioni = tuple(versioni)
+    return {"impegni": _impegni_da_copie_locali(versioni), "errori": errori, "letto": versioni}
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def docenti_impegnati_altrove(plesso, _df, versione, letto):
+    """{(giorno, ora): {docente: plesso}} per i docenti di questo orario,
+    una volta per versione di questo orario e di quelli degli altri plessi."""
+    return impegnati_altrove(
+        costruisci_indice_orario(_df, versione), _impegni_da_copie_locali(letto)
+    )
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def piano_della_giornata(plesso, _df, versione, data, assenti, uscita, versione_storico, limiti, letto):
+    """Ore scoperte, candidati e proposte, calcolati UNA volta per sessione
+    di pianificazione: la chiave è (plesso, versione dell'orario, data,
+    assenti, classi in uscita, versione dello storico, limiti, lettura
+    degli altri plessi), tutti valori
+    immutabili. Cambiare un selectbox non cambia la chiave, quindi il rerun
+    rilegge il piano dalla cache e ridisegna solo il riepilogo.
+
+    `assenti` è un frozenset, `uscita` una tupla ordinata di (ora, classi);
+    il risultato è condiviso e va trattato in sola lettura."""
+    return pianifica_sostituzioni(
+        _df, data, assenti, {ora: set(classi) for ora, classi in uscita},
+        indice=costruisci_indice_orario(_df, versione),
+        carico=carico_sostituzioni(), limiti=limiti,
+        altrove=docenti_impegnati_altrove(plesso, _df, versione, letto),
+    )
+
 def _colore_tipo(label):
     """Restituisce (bg, fg, icona) in base al tipo di sostituto nel label."""
     if "[S]" in label and "[NP]" not in label:
@@ -534,7 +1036,7 @@ def download_orario(df):
     if not df.empty:
         st.download_button(
             "⬇️ Scarica orario in CSV",
-            data=df.to_csv(index=False),
+            data=df.loc[:, REQUIRED_COLUMNS].to_csv(index=False),
             file_name="orario.csv",
             mime="text/csv"
         )
@@ -659,26 +1161,25 @@ document.getElementById('stampa-sostituzioni-btn').addEventListener('click', fun
 </script>
 """, height=55)
 
-def vista_pivot_docenti(df, mode="docenti"):
-    # Copiato e adattato da app.py per mantenere la stessa UX
-    if df.empty:
-        st.warning("Nessun orario disponibile.")
-        return
+# =========================
+# VISTE PIVOT DELL'ORARIO (precalcolate per versione, vedi motore_sostituzioni)
+# =========================
+@st.cache_resource(show_spinner=False, max_entries=4)
+def viste_orario(_df, versione):
+    """Pivot "docenti" e "classi" costruite UNA volta per versione dell'orario;
+    le viste filtrate per docente si ricavano da queste senza ripivotare."""
+    celle = celle_per_classe(_df)
+    return {
+        "docenti": costruisci_pivot_docenti(_df),
+        "celle": celle,
+        "classi_docente": classi_per_docente(_df),
+        "classi": vista_classi(celle),
+    }
 
+def vista_pivot_docenti(viste, mode="docenti", docenti=None):
+    """Mostra una delle viste precalcolate; con `docenti` la vista per classi
+    è ristretta ai docenti scelti."""
     if mode == "docenti":
-        dfp = df.copy()
-        def format_cell(row):
-            base = f"{row['Docente']} ({row['Classe']})"
-            return f"[S] {base}" if "Sostegno" in str(row["Tipo"]) else base
-        dfp["Info"] = dfp.apply(format_cell, axis=1)
-
-        pivot = dfp.pivot_table(
-            index="Ora",
-            columns="Giorno",
-            values="Info",
-            aggfunc=lambda x: " / ".join(x)
-        ).fillna("")
-
         def color_cells(val):
             text = str(val)
             if "[S]" in text:
@@ -687,59 +1188,427 @@ def vista_pivot_docenti(df, mode="docenti"):
                 return "color: #9C5F2C;"
             return ""
 
-        styled = pivot.style.map(color_cells)
+        styled = viste["docenti"].style.map(color_cells)
         st.dataframe(styled, use_container_width=True)
 
     elif mode == "classi":
-        dfp = df.copy()
-        dfp["Info"] = dfp["Docente"]
-
-        pivot = dfp.pivot_table(
-            index=["Giorno", "Ora"],
-            columns="Classe",
-            values="Info",
-            aggfunc=lambda x: " / ".join(list(dict.fromkeys(x)))
-        ).fillna("-")
-
-        def sort_classi(classe):
-            m = re.match(r"(\d+)\s*([A-Za-zÀ-ÖØ-öø-ÿ]+)", str(classe))
-            if m:
-                return (int(m.group(1)), m.group(2).upper())
-            return (10**9, str(classe))
-        pivot = pivot.reindex(sorted(pivot.columns, key=sort_classi), axis=1)
-
-        ordine_giorni = GIORNI_SETTIMANA
-        ordine_ore = ORE_LEZIONE
-        pivot = pivot.reindex(pd.MultiIndex.from_product([ordine_giorni, ordine_ore], names=["Giorno", "Ora"]))
-
-        pivot = pivot.reset_index()
-
-        new_rows = []
-        last_giorno = None
-        for _, row in pivot.iterrows():
-            if row["Giorno"] != last_giorno and last_giorno is not None:
-                empty_row = {col: "" for col in pivot.columns}
-                empty_row["Giorno"] = "──"
-                new_rows.append(empty_row)
-            new_rows.append(row.to_dict())
-            last_giorno = row["Giorno"]
-
-        pivot = pd.DataFrame(new_rows, columns=pivot.columns)
-
-        last_giorno = None
-        for i in range(len(pivot)):
-            if pivot.loc[i, "Giorno"] == last_giorno and pivot.loc[i, "Giorno"] not in ["", "──"]:
-                pivot.loc[i, "Giorno"] = ""
-            else:
-                last_giorno = pivot.loc[i, "Giorno"]
-
+        pivot = (
+            vista_classi_filtrata(viste["celle"], viste["classi_docente"], docenti)
+            if docenti else viste["classi"]
+        )
+        if len(pivot.columns) <= 1:
+            st.warning("Nessun risultato.")
+            return
         styled = pivot.style.set_properties(**{"text-align": "center"})
         st.dataframe(styled, use_container_width=True, hide_index=True)
 
+# =========================
+# PAGINA GESTIONE ASSENZE (fragment)
+# =========================
+# La pagina è divisa in due fragment annidati: un cambio dei dati di
+# partenza (data, assenti, uscite, limiti) riesegue solo la pianificazione,
+# la scelta di un sostituto solo selectbox, riepilogo ed esportazioni.
+# Intestazione, controllo dei fogli e caricamento dell'orario non si
+# ripetono in nessuno dei due casi.
+@st.fragment
+def pianificazione_assenze(orario_df):
+    """Dati di partenza, piano della giornata e tabella delle ore scoperte."""
+    data_sostituzione = st.date_input("Data della sostituzione")
+
+    # Giorno calcolato automaticamente dalla data (in italiano)
+    giorno_assente = giorno_della_data(data_sostituzione)
+
+    if giorno_assente not in GIORNI_SETTIMANA:
+        st.warning(f"Hai selezionato {giorno_assente}, un giorno non presente nell'orario scolastico (Lun-Ven).")
+
+    docenti_assenti = st.multiselect("Seleziona docenti assenti", sorted(orario_df["Docente"].unique()))
+
+    # =========================
+    # CLASSI IN USCITA DIDATTICA (libera i curricolari di quelle classi)
+    # =========================
+    classi_uscita_per_ora = {}  # {ora: set(classi in uscita in quell'ora)}
+    with st.expander("🚌 Classi in uscita didattica (oggi)"):
+        st.caption(
+            "Se una o più classi sono in uscita, i docenti curricolari [C] che in "
+            "quell'ora avrebbero lezione con quella classe risultano liberi e "
+            "selezionabili come sostituti, senza generare un conflitto alla conferma."
+        )
+        classi_disponibili = sorted(orario_df["Classe"].unique()) if not orario_df.empty else []
+        classi_uscita_selezionate = st.multiselect(
+            "Classi in uscita",
+            classi_disponibili,
+            key="classi_uscita_multiselect"
+        )
+        for classe_u in classi_uscita_selezionate:
+            ore_classe_u = [o for o in ORE_LEZIONE if not orario_df[
+                (orario_df["Classe"] == classe_u) &
+                (orario_df["Giorno"] == giorno_assente) &
+                (orario_df["Ora"] == o)
+            ].empty]
+            if not ore_classe_u:
+                st.caption(f"⚠️ {classe_u} non ha lezioni previste {giorno_assente}.")
+                continue
+            ore_scelte_u = st.multiselect(
+                f"Ore in uscita per {classe_u} (default: tutta la giornata)",
+                ore_classe_u,
+                default=ore_classe_u,
+                key=f"ore_uscita_{classe_u}"
+            )
+            for ora_u in ore_scelte_u:
+                classi_uscita_per_ora.setdefault(ora_u, set()).add(classe_u)
+
+    # =========================
+    # PIANIFICAZIONE DELL'INTERA GIORNATA (limiti per docente)
+    # =========================
+    with st.expander("📅 Limiti per docente nella giornata"):
+        st.caption(
+            "Con la pianificazione della giornata le proposte si decidono tutte "
+            "insieme: nessun docente supera il numero massimo di sostituzioni "
+            "né di ore di sostituzione di fila. Se non resta nessuno, la proposta "
+            "è «Nessuno» con il motivo."
+        )
+        pianifica_giorno = st.checkbox("Pianifica l'intera giornata", value=True, key="pianifica_giorno")
+        col_lim1, col_lim2 = st.columns(2)
+        with col_lim1:
+            max_sost_giorno = st.number_input(
+                "Max sostituzioni per docente", min_value=1, max_value=len(ORE_LEZIONE),
+                value=LimitiGiornata().max_sostituzioni, key="max_sost_giorno",
+                disabled=not pianifica_giorno,
+            )
+        with col_lim2:
+            max_ore_fila = st.number_input(
+                "Max ore di fila", min_value=1, max_value=len(ORE_LEZIONE),
+                value=LimitiGiornata().max_consecutive, key="max_ore_fila",
+                disabled=not pianifica_giorno,
+            )
+    limiti_giornata = (
+        LimitiGiornata(int(max_sost_giorno), int(max_ore_fila)) if pianifica_giorno else None
+    )
+
+    if not docenti_assenti:
+        st.info("Seleziona almeno un docente per continuare.")
+        return
+
+    # Indice dell'orario per (Giorno, Ora) / (Giorno, Ora, Classe): costruito
+    # una volta per versione dell'orario, non ad ogni rerun.
+    versione = versione_orario(orario_df)
+    indice = costruisci_indice_orario(orario_df, versione)
+
+    # Ore scoperte + candidati ordinati e proposta per ognuna: tutta la
+    # logica di priorità sta in motore_sostituzioni.pianifica_sostituzioni.
+    # (mostriamo le ore anche se l'assente ha Escludi True)
+    # A parità di fascia si propone chi ha svolto meno ore di sostituzione.
+    # Il piano è in cache: i rerun dovuti ai selectbox non lo ricalcolano.
+    # Chi in un'ora è in servizio in un altro plesso non viene proposto come [NP]
+    altri_plessi = impegni_altri_plessi(PLESSO_CHIAVE)
+    piano = piano_della_giornata(
+        PLESSO_CHIAVE, orario_df, versione, data_sostituzione, frozenset(docenti_assenti),
+        tuple(sorted((ora, tuple(sorted(classi))) for ora, classi in classi_uscita_per_ora.items())),
+        archivio_locale.versione(DB_LOCALE, STORICO_SHEET), limiti_giornata, altri_plessi["letto"],
+    )
+    ore_assenti = piano.ore_assenti
+
+    if ore_assenti.empty:
+        st.info("I docenti selezionati non hanno lezioni in quel giorno.")
+        return
+
+    st.subheader("📌 Ore scoperte")
+
+    # --- Sostegni in servizio per ogni ora scoperta: una merge con la
+    # tabella precalcolata per versione, qualunque sia il numero di assenti ---
+    ore_assenti_display = ore_assenti[["Docente", "Giorno", "Ora", "Classe", "Tipo"]].astype({"Ora": str}).merge(
+        tabella_sostegni_in_servizio(orario_df, versione),
+        on=["Giorno", "Ora", "Classe"], how="left",
+    )
+    ore_assenti_display["Sostegni in servizio"] = ore_assenti_display["Sostegni in servizio"].fillna("—")
+
+    # Ordina in modo naturale
+    ore_assenti_display = ore_assenti_display[["Docente", "Ora", "Classe", "Tipo", "Sostegni in servizio"]]
+
+    st.dataframe(ore_assenti_display, use_container_width=True, hide_index=True)
+
+    altrove = docenti_impegnati_altrove(PLESSO_CHIAVE, orario_df, versione, altri_plessi["letto"])
+    in_altro_plesso = [
+        f"{ora} ora: " + ", ".join(f"{d} ({p})" for d, p in sorted(altrove[(giorno_assente, ora)].items()))
+        for ora in ORE_LEZIONE
+        if (giorno_assente, ora) in altrove and ora in set(ore_assenti["Ora"].astype(str))
+    ]
+    if in_altro_plesso:
+        st.caption("🏫 In servizio in un altro plesso, quindi non proposti come [NP]: " + "; ".join(in_altro_plesso))
+    if altri_plessi["errori"]:
+        st.caption(
+            "⚠️ Orario non disponibile per " + ", ".join(altri_plessi["errori"])
+            + ": i docenti in comune non vengono controllati."
+        )
+
+    scelta_sostituti(orario_df, piano, indice, data_sostituzione, giorno_assente, classi_uscita_per_ora)
+
+
+@st.fragment
+def scelta_sostituti(orario_df, piano, indice, data_sostituzione, giorno_assente, classi_uscita_per_ora):
+    """Un selectbox per ogni ora scoperta, riepilogo, esportazioni e salvataggio.
+    Cambiare un sostituto riesegue solo questa funzione."""
+    ore_assenti = piano.ore_assenti
+
+    st.subheader("🔄 Possibili sostituti")
+    sostituzioni = []
+
+    ora_corrente = None  # tiene traccia dell'ora per mostrare il separatore
+
+    # Per ogni ora scoperta il motore ha già costruito la lista di opzioni
+    # con l'ordine richiesto e il sostituto proposto
+    for riga in piano.righe:
+        ora = riga.ora
+        classe = riga.classe
+        assente = riga.assente
+        options = list(riga.opzioni)
+        proposto_display = riga.proposto
+
+        # Intestazione visiva quando cambia l'ora
+        if ora != ora_corrente:
+            if ora_corrente is not None:
+                st.markdown("<hr style='border:none;border-top:2px solid #E3D9C2;margin:16px 0 12px;'>", unsafe_allow_html=True)
+            st.markdown(
+                f'<div style="background:#EFE6D3;border-radius:10px;padding:8px 14px;'
+                f'font-weight:800;font-size:1.05em;color:#3A2E1F;margin-bottom:10px;">'
+                f'🕐 {ora} ora</div>',
+                unsafe_allow_html=True
+            )
+            ora_corrente = ora
+
+        default_index = options.index(proposto_display) if proposto_display in options else 0
+
+        col_sx, col_dx = st.columns([3, 1])
+        with col_sx:
+            st.markdown(
+                f"Classe **{classe}** · Assente: *{assente}*",
+            )
+        bg, fg, ico = _colore_tipo(proposto_display)
+        with col_dx:
+            st.markdown(
+                f'<div style="background:{bg};color:{fg};border-radius:8px;'
+                f'padding:4px 8px;font-size:0.78em;font-weight:700;text-align:center;">'
+                f'{ico} proposto</div>',
+                unsafe_allow_html=True
+            )
+
+        scelta = st.selectbox(
+            f"Sostituto",
+            options,
+            index=default_index,
+            key=f"sost_{assente}_{ora}_{classe}",
+            label_visibility="collapsed",
+        )
+        if riga.motivo:
+            st.caption(f"ℹ️ Nessuna proposta: {riga.motivo}")
+
+        # Badge colorato per la scelta corrente
+        bg2, fg2, ico2 = _colore_tipo(scelta)
+        tipo_label = (
+            "Sostegno" if "[S]" in scelta and "[NP]" not in scelta
+            else "Uscita" if "[USCITA]" in scelta
+            else "Non in orario" if "[NP]" in scelta
+            else "Curricolare" if "[C]" in scelta
+            else "—"
+        )
+        if scelta != "Nessuno":
+            st.markdown(
+                f'<div style="background:{bg2};color:{fg2};border-radius:10px;'
+                f'padding:6px 12px;font-size:0.85em;font-weight:600;'
+                f'margin-bottom:8px;display:inline-block;">'
+                f'{ico2} {tipo_label}</div>',
+                unsafe_allow_html=True
+            )
+        st.markdown("---")
+
+        # pulisco il nome per lo storico (rimuovo prefissi tipo "[S] [NP] " ecc.)
+        nome_pulito = pulisci_etichetta(scelta)
+
+        sostituzioni.append({
+            "Ora": ora,
+            "Classe": classe,
+            "Assente": assente,
+            "Sostituto_display": scelta,
+            "Sostituto": nome_pulito
+        })
+
+    sostituzioni_df = pd.DataFrame(sostituzioni)
+
+    # Ordina per ora
+    ordine_ore = ORE_LEZIONE
+    if not sostituzioni_df.empty:
+        sostituzioni_df["Ora"] = pd.Categorical(sostituzioni_df["Ora"], categories=ordine_ore, ordered=True)
+        sostituzioni_df = sostituzioni_df.sort_values("Ora").reset_index(drop=True)
+
+    tabella_df = sostituzioni_df[["Ora", "Classe", "Assente", "Sostituto_display"]].copy()
+    tabella_df = tabella_df.rename(columns={"Sostituto_display": "Sostituzione"})
+    tabella_df["Ora"] = pd.Categorical(tabella_df["Ora"], categories=ordine_ore, ordered=True)
+    tabella_df = tabella_df.sort_values(["Ora", "Classe"]).reset_index(drop=True)
+    st.subheader("📋 Riepilogo sostituzioni")
+
+    cards_html = ""
+    for ora_c, grp in tabella_df.groupby("Ora", sort=False):
+        righe_html = ""
+        for _, r in grp.iterrows():
+            badge = _badge_sostituto(r["Sostituzione"])
+            righe_html += (
+                f'<div style="display:flex;justify-content:space-between;'
+                f'align-items:center;padding:8px 0;border-bottom:1px solid #EFE6D3;">'
+                f'<div><span style="font-weight:700;color:#3A2E1F;">Cl. {r["Classe"]}</span>'
+                f'<span style="color:#9C5F2C;font-size:0.85em;margin-left:6px;">ass. {r["Assente"]}</span></div>'
+                f'<div>{badge}</div></div>'
+            )
+        cards_html += (
+            f'<div style="background:#FBF4E6;border:1.5px solid #E3D9C2;border-radius:14px;'
+            f'padding:12px 14px;margin-bottom:10px;">'
+            f'<div style="font-size:1em;font-weight:800;color:#C97D3D;margin-bottom:4px;">'
+            f'🕐 {ora_c} ora</div>{righe_html}</div>'
+        )
+    st.markdown(cards_html, unsafe_allow_html=True)
+
+    # --- VISTA TESTUALE ---
+    st.subheader("📝 Sostituzioni in formato testo (mobile/copincolla)")
+    testo_output = "Buongiorno, supplenze:\n\n"
+
+    # uso sostituzioni_df che ha sia display che nome pulito
+    for ora, gruppo in sostituzioni_df.groupby("Ora"):
+        if not gruppo.empty:
+            testo_output += f"🕐 *{ora} ORA*\n"
+            for _, r in gruppo.iterrows():
+                sost_pulito = r['Sostituto'] if r['Sostituto'] not in ["Nessuno", "", "—"] else "—"
+                testo_output += f"Classe {r['Classe']}\n"
+                testo_output += f"👩‍🏫 Assente: {r['Assente']}\n"
+                testo_output += f"✅ Sostituzione: {sost_pulito}\n\n"
+
+    testo_strip = testo_output.strip()
+    st.text_area("Testo pronto da copiare", value=testo_strip, height=300)
+    # Bottone "Copia negli appunti" via JavaScript.
+    # json.dumps si occupa di tutto l'escaping (virgolette, backslash, a capo),
+    # evitando i replace manuali che non coprivano le virgolette doppie.
+    testo_json = json.dumps(testo_strip)
+    st.components.v1.html(f"""
+<button id="copia-sostituzioni-btn" style="
+    width:100%; padding:0.7em; font-size:1em; font-weight:bold;
+    background:#C97D3D; color:white; border:none; border-radius:10px; cursor:pointer;
+">📋 Copia negli appunti</button>
+<script>
+document.getElementById('copia-sostituzioni-btn').addEventListener('click', function() {{
+    navigator.clipboard.writeText({testo_json}).then(() => {{
+        this.innerText = '✅ Copiato!';
+        setTimeout(() => {{ this.innerText = '📋 Copia negli appunti'; }}, 2000);
+    }});
+}});
+</script>
+""", height=55)
+
+    # --- Riepilogo stampabile / PDF per la bacheca (v2.2) ---
+    st.subheader("🖨️ Riepilogo per la bacheca")
+    st.caption(
+        "Apre una finestra pronta per la stampa. Dal dialogo di stampa del "
+        "browser puoi scegliere una stampante fisica oppure \"Salva come PDF\"."
+    )
+    pulsante_stampa_sostituzioni(PLESSO_NAME, data_sostituzione, giorno_assente, tabella_df)
+
+    # --- Step 1: conferma (controllo conflitti) ---
+    if st.button("✅ Conferma tabella (non salva ancora)", type="primary"):
+        # Controllo vettoriale: una groupby per i doppioni e una merge
+        # con le lezioni del giorno per i curricolari già in classe
+        verifica = verifica_conferma(
+            sostituzioni_df, indice, giorno_assente, classi_uscita_per_ora
+        )
+        if not verifica.ok:
+            if not verifica.duplicati.empty:
+                st.error("⚠️ Errore: lo stesso docente è stato assegnato a più classi nella stessa ora:")
+                for ora_c, docente, classi in verifica.duplicati.itertuples(index=False, name=None):
+                    st.write(f"- Ora {ora_c}: {docente} (classi {', '.join(classi)})")
+            if not verifica.occupati.empty:
+                st.error("⚠️ Errore: alcuni docenti curricolari scelti come supplenti hanno già lezione in quell’ora:")
+                for ora_c, classe_c, docente, classe_lezione in verifica.occupati.itertuples(
+                    index=False, name=None
+                ):
+                    st.write(
+                        f"- Ora {ora_c}: {docente} è già impegnato in orario "
+                        f"(classe {classe_lezione}), scelto per la {classe_c}"
+                    )
+            st.stop()
+
+        # se tutto ok salvo in session_state
+        st.session_state["sostituzioni_confermate"] = sostituzioni_df.copy()
+        st.session_state["ore_assenti_confermate"] = ore_assenti.copy()
+        st.session_state["data_sostituzione_tmp"] = data_sostituzione
+        st.session_state["giorno_assente_tmp"] = giorno_assente
+
+        st.success("Tabella confermata ✅ Ora puoi salvarla nello storico.")
+
+
+    # --- Step 2: Salva nello storico ---
+    if st.session_state.get("sostituzioni_confermate") is not None:
+        if st.button("💾 Salva nello storico", key="save_storico_main", type="primary"):
+            sost_df = st.session_state.get("sostituzioni_confermate")
+            ore_assenti_session = st.session_state.get("ore_assenti_confermate")
+            data_tmp = st.session_state.get("data_sostituzione_tmp")
+            giorno_tmp = st.session_state.get("giorno_assente_tmp")
+
+            if sost_df is not None and ore_assenti_session is not None:
+                # salva_storico_assenze si aspetta la colonna "Sostituto" con il nome pulito
+                if salva_storico_assenze(data_tmp, giorno_tmp, sost_df, ore_assenti_session):
+                    st.success("Assenze e sostituzioni salvate nello storico ✅ L'invio a Google Sheets prosegue in background.")
+                    for k in ["sostituzioni_confermate", "ore_assenti_confermate",
+                              "data_sostituzione_tmp", "giorno_assente_tmp"]:
+                        st.session_state.pop(k, None)
+                    try:
+                        st.rerun()
+                    except Exception:
+                        pass
+
+
 # =========================
 # AVVIO APP
 # =========================
+def _eta_leggibile(secondi):
+    """Età dei dati in forma breve per l'intestazione: "ora", "4 min", "2 h"."""
+    if secondi is None:
+        return "—"
+    if secondi < 60:
+        return "ora"
+    if secondi < 3600:
+        return f"{int(secondi // 60)} min"
+    if secondi < 86400:
+        return f"{int(secondi // 3600)} h"
+    return f"{int(secondi // 86400)} g"
+
 def mostra_intestazione():
+    # Età della copia locale accanto al 🔄: dice a colpo d'occhio quanto sono
+    # "freschi" i dati mostrati mentre l'aggiornamento gira in background.
+    eta = _eta_leggibile(eta_dati())
+    errore = _stato_aggiornamento(PLESSO_CHIAVE)["errore"]
+    if aggiornamento_in_corso():
+        stato_dati, titolo_dati = f"⏳ {eta}", "Aggiornamento da Google Sheets in corso"
+    elif errore:
+        stato_dati, titolo_dati = f"⚠️ {eta}", f"Ultimo aggiornamento non riuscito: {errore}"
+    else:
+        stato_dati, titolo_dati = eta, "Età dei dati rispetto a Google Sheets"
+    # record di storico/assenze salvati ma non ancora arrivati a Google
+    in_coda = record_in_sospeso()
+    if in_coda:
+        errore_invio = _stato_invio(PLESSO_CHIAVE)["errore"]
+        titolo_coda = f"{in_coda} record in invio a Google Sheets" + (
+            f" (ultimo tentativo non riuscito: {errore_invio})" if errore_invio else ""
+        )
+        coda_html = (
+            f'<span title="{html_lib.escape(titolo_coda)}" '
+            f'style="font-size:0.7em; color:#9C5F2C; font-weight:600;">📤 {in_coda}</span>'
+        )
+    else:
+        coda_html = ""
+    # con più plessi configurati l'icona riporta alla scelta del plesso
+    if len(PLESSI) > 1:
+        icona_plesso = (
+            '<a href="?cambia_plesso=1" target="_self" title="Cambia plesso" '
+            'style="font-size:2.1em; line-height:1; text-decoration:none;">🏫</a>'
+        )
+    else:
+        icona_plesso = '<div style="font-size:2.1em; line-height:1;">🏫</div>'
     st.markdown(
         f"""
 <div style="
@@ -750,7 +1619,7 @@ def mostra_intestazione():
     box-shadow:0 3px 10px rgba(58,46,31,0.12);
 ">
   <div style="display:flex; align-items:center; gap:14px;">
-    <div style="font-size:2.1em; line-height:1;">🏫</div>
+    {icona_plesso}
     <div>
       <div style="font-size:1.35em; font-weight:800; color:#3A2E1F; line-height:1.15;">
         {PLESSO_NAME}
@@ -761,10 +1630,12 @@ def mostra_intestazione():
     </div>
   </div>
   <div style="display:flex; flex-direction:column; align-items:center; gap:2px; flex-shrink:0;">
-    <a href="?ricarica=1" target="_self" title="Ricarica dati da Google Sheets" style="
+    <a href="?plesso={html_lib.escape(PLESSO_CHIAVE)}&amp;ricarica=1" target="_self" title="Ricarica dati da Google Sheets" style="
       font-size:1.5em; line-height:1; text-decoration:none;
       color:#C97D3D;
     ">🔄</a>
+    <span title="{html_lib.escape(titolo_dati)}" style="font-size:0.7em; color:#9C5F2C; font-weight:600;">{stato_dati}</span>
+    {coda_html}
     <span style="font-size:0.7em; color:#B0A090; font-weight:600;">v{APP_VERSION}</span>
   </div>
 </div>
@@ -772,21 +1643,63 @@ def mostra_intestazione():
         unsafe_allow_html=True,
     )
 
+prepara_archivio_locale(DB_LOCALE)
+
 mostra_intestazione()
 
 # Gestione ricarica via query param
 if st.query_params.get("ricarica") == "1":
-    carica_orario.clear()
-    carica_statistiche.clear()
-    st.query_params.clear()
-    st.rerun()
+    del st.query_params["ricarica"]
+    ricaricato = False
+    try:
+        with st.spinner('Ricarico i dati da Google Sheets...'):
+            allinea_da_google()
+        ricaricato = True
+    except Exception as e:
+        st.error(f"Impossibile ricaricare i dati da Google Sheets: {e}")
+    if ricaricato:
+        st.rerun()
+
+# assicurati che i fogli esistano con le intestazioni. Se c'è già la copia
+# locale non si aspetta Google: lo fa il riallineamento in background.
+if eta_dati() is None:
+    try:
+        with st.spinner('Caricamento dati...'):
+            ensure_sheets_exist()
+    except Exception as e:
+        st.error(f"Impossibile inizializzare i fogli Google: {e}")
 
-# assicurati che i fogli esistano con le intestazioni
+# scritture rimaste in sospeso (Google non raggiungibile al momento del
+# salvataggio, o server riavviato prima dell'invio): riparte il thread di invio
+if any(archivio_locale.in_sospeso(DB_LOCALE, f) for f in COLONNE_PER_FOGLIO):
+    try:
+        invia_in_background()
+    except Exception as e:
+        st.warning(f"Invio a Google Sheets delle modifiche in sospeso non avviato: {e}")
+
+# dati locali troppo vecchi: si continua con quelli e si riallinea in background
+errore_avvio_aggiornamento = None
 try:
-    with st.spinner('Caricamento dati...'):
-        ensure_sheets_exist()
+    aggiorna_in_background()
 except Exception as e:
-    st.error(f"Impossibile inizializzare i fogli Google: {e}")
+    errore_avvio_aggiornamento = str(e)
+    st.warning(f"Aggiornamento automatico da Google Sheets non avviato: {e}")
+
+if dati_offline():
+    momento = datetime.fromtimestamp(min(
+        archivio_locale.ultimo_aggiornamento(DB_LOCALE, f) for f in COLONNE_PER_FOGLIO
+    )).strftime("%d/%m/%Y alle %H:%M")
+    if aggiornamento_in_corso():
+        st.info(f"📴 Dati offline del {momento}: riallineamento con Google Sheets in corso…")
+    else:
+        # nessun thread attivo: l'ultimo tentativo è fallito (o non è partito)
+        # e il prossimo arriverà a un rerun dopo ATTESA_NUOVO_TENTATIVO
+        errore_google = _stato_aggiornamento(PLESSO_CHIAVE)["errore"] or errore_avvio_aggiornamento
+        motivo = f" ({errore_google})" if errore_google else ""
+        st.warning(
+            f"📴 Dati offline del {momento}: Google Sheets non risponde{motivo}. "
+            "Le modifiche restano salvate sul server e verranno inviate appena possibile."
+        )
 
 with st.spinner('Caricamento orario...'):
     orario_df = carica_orario()
@@ -895,7 +1808,8 @@ if menu == "Inserisci/Modifica Orario":
     st.subheader("📝 Modifica orario attuale")
     if not orario_df.empty:
         col_order = REQUIRED_COLUMNS
-        df_edit = orario_df[col_order].copy()
+        # l'editor lavora su testo: con i categoriali non si potrebbero scrivere valori nuovi
+        df_edit = orario_df[col_order].astype({c: str for c in ["Docente", "Giorno", "Ora", "Classe", "Tipo"]})
         df_edit = df_edit.sort_values(by=["Docente"])
         edited_df = st.data_editor(
             df_edit,
@@ -937,478 +1851,7 @@ elif menu == "Gestione Assenze":
     if orario_df.empty:
         st.warning("Non hai ancora caricato nessun orario.")
     else:
-        data_sostituzione = st.date_input("Data della sostituzione")
-
-        # Giorno calcolato automaticamente dalla data (in italiano)
-        giorno_assente = data_sostituzione.strftime("%A")
-        traduzione_giorni = {
-            "Monday": "Lunedì", "Tuesday": "Martedì", "Wednesday": "Mercoledì",
-            "Thursday": "Giovedì", "Friday": "Venerdì", "Saturday": "Sabato", "Sunday": "Domenica"
-        }
-        giorno_assente = traduzione_giorni.get(giorno_assente, giorno_assente)
-
-        if giorno_assente not in GIORNI_SETTIMANA:
-            st.warning(f"Hai selezionato {giorno_assente}, un giorno non presente nell'orario scolastico (Lun-Ven).")
-
-        docenti_assenti = st.multiselect("Seleziona docenti assenti", sorted(orario_df["Docente"].unique()))
-
-        # =========================
-        # CLASSI IN USCITA DIDATTICA (libera i curricolari di quelle classi)
-        # =========================
-        classi_uscita_per_ora = {}  # {ora: set(classi in uscita in quell'ora)}
-        with st.expander("🚌 Classi in uscita didattica (oggi)"):
-            st.caption(
-                "Se una o più classi sono in uscita, i docenti curricolari [C] che in "
-                "quell'ora avrebbero lezione con quella classe risultano liberi e "
-                "selezionabili come sostituti, senza generare un conflitto alla conferma."
-            )
-            classi_disponibili = sorted(orario_df["Classe"].unique()) if not orario_df.empty else []
-            classi_uscita_selezionate = st.multiselect(
-                "Classi in uscita",
-                classi_disponibili,
-                key="classi_uscita_multiselect"
-            )
-            for classe_u in classi_uscita_selezionate:
-                ore_classe_u = [o for o in ORE_LEZIONE if not orario_df[
-                    (orario_df["Classe"] == classe_u) &
-                    (orario_df["Giorno"] == giorno_assente) &
-                    (orario_df["Ora"] == o)
-                ].empty]
-                if not ore_classe_u:
-                    st.caption(f"⚠️ {classe_u} non ha lezioni previste {giorno_assente}.")
-                    continue
-                ore_scelte_u = st.multiselect(
-                    f"Ore in uscita per {classe_u} (default: tutta la giornata)",
-                    ore_classe_u,
-                    default=ore_classe_u,
-                    key=f"ore_uscita_{classe_u}"
-                )
-                for ora_u in ore_scelte_u:
-                    classi_uscita_per_ora.setdefault(ora_u, set()).add(classe_u)
-
-        if not docenti_assenti:
-            st.info("Seleziona almeno un docente per continuare.")
-        else:
-            # Ore scoperte dell'assente (mostriamo anche se l'assente ha Escludi True)
-            ore_assenti = orario_df[
-                (orario_df["Docente"].isin(docenti_assenti)) &
-                (orario_df["Giorno"] == giorno_assente)
-            ].copy()
-
-            if ore_assenti.empty:
-                st.info("I docenti selezionati non hanno lezioni in quel giorno.")
-            else:
-                st.subheader("📌 Ore scoperte")
-
-                # --- Aggiunta: calcolo sostegni in servizio per ogni ora scoperta ---
-                ore_assenti_display = ore_assenti.copy()
-                sostegni_presenti = []
-
-                for _, r in ore_assenti.iterrows():
-                    ora = r["Ora"]
-                    classe = r["Classe"]
-
-                    # Cerca docenti di sostegno in quella classe-ora
-                    sost_df = orario_df[
-                        (orario_df["Giorno"] == giorno_assente) &
-                        (orario_df["Ora"] == ora) &
-                        (orario_df["Classe"] == classe) &
-                        (orario_df["Tipo"].str.lower() == "sostegno")
-                    ]
-
-                    if sost_df.empty:
-                        sostegni_presenti.append("—")
-                    else:
-                        # Elenco nomi separati da virgola
-                        lista = ", ".join(sorted(sost_df["Docente"].unique()))
-                        sostegni_presenti.append(lista)
-
-                # Colonna aggiuntiva
-                ore_assenti_display["Sostegni in servizio"] = sostegni_presenti
-
-                # Ordina in modo naturale
-                ore_assenti_display = ore_assenti_display[["Docente", "Ora", "Classe", "Tipo", "Sostegni in servizio"]]
-
-                st.dataframe(ore_assenti_display, use_container_width=True, hide_index=True)
-
-
-                st.subheader("🔄 Possibili sostituti")
-                sostituzioni = []
-
-                # Precalcolo: tutti i docenti (escludiamo definitivamente chi ha Escludi=True)
-                tutti_docenti = sorted(orario_df["Docente"].unique())
-                escludi_docenti = set(orario_df[orario_df["Escludi"]]["Docente"].unique())
-                # Tutti i docenti assenti oggi (non solo quello della singola ora): nessuno di
-                # loro può comparire come possibile sostituto, in nessuna ora.
-                docenti_assenti_set = set(docenti_assenti)
-
-                # Mappa docente -> tipo, calcolata UNA volta sola
-                docente_tipo_map = build_docente_tipo_map(orario_df)
-                def tipo_docente(d):
-                    return docente_tipo_map.get(d, "")
-
-                # Ordino per ora (I → VI) in modo che tutte le I ore compaiano
-                # insieme, poi le II, ecc. — indipendentemente da quanti docenti
-                # sono assenti e dall'ordine in cui sono stati selezionati.
-                ore_assenti["Ora"] = pd.Categorical(
-                    ore_assenti["Ora"], categories=ORE_LEZIONE, ordered=True
-                )
-                ore_assenti = ore_assenti.sort_values(["Ora", "Docente"]).reset_index(drop=True)
-
-                ora_corrente = None  # tiene traccia dell'ora per mostrare il separatore
-
-                # Per ogni ora scoperta costruisco la lista di opzioni con l'ordine richiesto
-                for _, row in ore_assenti.iterrows():
-                    ora = row["Ora"]
-                    classe = row["Classe"]
-                    assente = row["Docente"]
-
-                    # Intestazione visiva quando cambia l'ora
-                    if ora != ora_corrente:
-                        if ora_corrente is not None:
-                            st.markdown("<hr style='border:none;border-top:2px solid #E3D9C2;margin:16px 0 12px;'>", unsafe_allow_html=True)
-                        st.markdown(
-                            f'<div style="background:#EFE6D3;border-radius:10px;padding:8px 14px;'
-                            f'font-weight:800;font-size:1.05em;color:#3A2E1F;margin-bottom:10px;">'
-                            f'🕐 {ora} ora</div>',
-                            unsafe_allow_html=True
-                        )
-                        ora_corrente = ora
-
-                    # Docenti presenti in quell'ora (escludiamo chi ha Escludi=True e
-                    # chiunque sia stato segnato assente oggi, non solo l'assente di questa riga)
-                    presenti_ora_df = orario_df[
-                        (orario_df["Giorno"] == giorno_assente) &
-                        (orario_df["Ora"] == ora) &
-                        (~orario_df["Escludi"]) &
-                        (~orario_df["Docente"].isin(docenti_assenti_set))
-                    ].copy()
-
-                    presenti_ora = list(dict.fromkeys(presenti_ora_df["Docente"].tolist()))  # mantiene ordine stabile
-
-                    added = set()
-                    options = ["Nessuno"]
-
-                    # 1) Sostegni della stessa classe in quell'ora -> [S]
-                    same_class_sost = presenti_ora_df[
-                        (presenti_ora_df["Tipo"].str.lower() == "sostegno") &
-                        (presenti_ora_df["Classe"] == classe) &
-                        (presenti_ora_df["Docente"] != assente)
-                    ]["Docente"].unique().tolist()
-                    for d in sorted(same_class_sost):
-                        label = f"[S] {d}"
-                        if d not in added:
-                            options.append(label); added.add(d)
-
-                    # 2) Altri sostegni presenti in quell'ora -> [S]
-                    other_sost = presenti_ora_df[
-                        (presenti_ora_df["Tipo"].str.lower() == "sostegno") &
-                        (presenti_ora_df["Docente"] != assente)
-                    ]["Docente"].unique().tolist()
-                    for d in sorted(other_sost):
-                        if d in added: 
-                            continue
-                        label = f"[S] {d}"
-                        options.append(label); added.add(d)
-
-                    # 3) Curricolari presenti in quell'ora -> [C], a meno che la loro
-                    # classe non sia in uscita didattica in quell'ora (in tal caso sono
-                    # liberi -> [C] [USCITA])
-                    curricolari_presenti_df = presenti_ora_df[
-                        (presenti_ora_df["Tipo"].str.lower() != "sostegno") &
-                        (presenti_ora_df["Docente"] != assente)
-                    ]
-                    uscita_classi_ora = classi_uscita_per_ora.get(ora, set())
-
-                    curricolari_liberi_uscita = curricolari_presenti_df[
-                        curricolari_presenti_df["Classe"].isin(uscita_classi_ora)
-                    ]["Docente"].unique().tolist()
-
-                    curricolari_occupati = curricolari_presenti_df[
-                        ~curricolari_presenti_df["Classe"].isin(uscita_classi_ora)
-                    ]["Docente"].unique().tolist()
-
-                    # 3a) Curricolari liberi perché la classe è in uscita -> [C] [USCITA]
-                    for d in sorted(curricolari_liberi_uscita):
-                        if d in added:
-                            continue
-                        label = f"[C] [USCITA] {d}"
-                        options.append(label); added.add(d)
-
-                    # 3b) Curricolari realmente occupati in quell'ora -> [C]
-                    for d in sorted(curricolari_occupati):
-                        if d in added:
-                            continue
-                        label = f"[C] {d}"
-                        options.append(label); added.add(d)
-
-                    # 4) Docenti che NON compaiono in quell'ora -> [S] [NP] o [C] [NP]
-                    # candidati NP: tutti i docenti presenti nell'orario generale MA non in 'presenti_ora',
-                    # non assenti oggi (nessuno di loro), non escludi
-                    presenti_ora_set = set(presenti_ora)
-                    np_candidates = [
-                        d for d in tutti_docenti
-                        if d not in presenti_ora_set
-                        and d not in docenti_assenti_set
-                        and d not in escludi_docenti
-                    ]
-
-                    # separo NP in S e C (in base al "Tipo" trovato nell'orario)
-                    np_sost = []
-                    np_curr = []
-                    for d in np_candidates:
-                        t = tipo_docente(d).lower()
-                        if t == "sostegno":
-                            np_sost.append(d)
-                        else:
-                            np_curr.append(d)
-
-                    # Aggiungo prima NP sostegni, poi NP curricolari
-                    for d in sorted(np_sost):
-                        if d in added:
-                            continue
-                        label = f"[S] [NP] {d}"
-                        options.append(label); added.add(d)
-
-                    for d in sorted(np_curr):
-                        if d in added:
-                            continue
-                        label = f"[C] [NP] {d}"
-                        options.append(label); added.add(d)
-
-                    # Rimuovo eventuali docenti esclusi (già filtrati) e assente (già escluso)
-                    # --- suggerimento automatico (come prima gerarchia, con i liberi per
-                    # uscita subito dopo i sostegni e prima dei curricolari davvero occupati) ---
-                    proposto_display = "Nessuno"
-                    if len(same_class_sost) > 0:
-                        proposto_display = f"[S] {sorted(same_class_sost)[0]}"
-                    elif len(other_sost) > 0:
-                        proposto_display = f"[S] {sorted(other_sost)[0]}"
-                    elif len(curricolari_liberi_uscita) > 0:
-                        proposto_display = f"[C] [USCITA] {sorted(curricolari_liberi_uscita)[0]}"
-                    elif len(curricolari_occupati) > 0:
-                        proposto_display = f"[C] {sorted(curricolari_occupati)[0]}"
-                    elif len(np_sost) > 0:
-                        proposto_display = f"[S] [NP] {sorted(np_sost)[0]}"
-                    elif len(np_curr) > 0:
-                        proposto_display = f"[C] [NP] {sorted(np_curr)[0]}"
-
-                    default_index = options.index(proposto_display) if proposto_display in options else 0
-
-                    col_sx, col_dx = st.columns([3, 1])
-                    with col_sx:
-                        st.markdown(
-                            f"Classe **{classe}** · Assente: *{assente}*",
-                        )
-                    bg, fg, ico = _colore_tipo(proposto_display)
-                    with col_dx:
-                        nome_prop = proposto_display.replace("[S] [NP] ","").replace("[C] [NP] ","") \
-                            .replace("[C] [USCITA] ","").replace("[S] ","").replace("[C] ","").strip()
-                        st.markdown(
-                            f'<div style="background:{bg};color:{fg};border-radius:8px;'
-                            f'padding:4px 8px;font-size:0.78em;font-weight:700;text-align:center;">'
-                            f'{ico} proposto</div>',
-                            unsafe_allow_html=True
-                        )
-
-                    scelta = st.selectbox(
-                        f"Sostituto",
-                        options,
-                        index=default_index,
-                        key=f"sost_{assente}_{ora}_{classe}",
-                        label_visibility="collapsed",
-                    )
-
-                    # Badge colorato per la scelta corrente
-                    bg2, fg2, ico2 = _colore_tipo(scelta)
-                    tipo_label = (
-                        "Sostegno" if "[S]" in scelta and "[NP]" not in scelta
-                        else "Uscita" if "[USCITA]" in scelta
-                        else "Non in orario" if "[NP]" in scelta
-                        else "Curricolare" if "[C]" in scelta
-                        else "—"
-                    )
-                    if scelta != "Nessuno":
-                        st.markdown(
-                            f'<div style="background:{bg2};color:{fg2};border-radius:10px;'
-                            f'padding:6px 12px;font-size:0.85em;font-weight:600;'
-                            f'margin-bottom:8px;display:inline-block;">'
-                            f'{ico2} {tipo_label}</div>',
-                            unsafe_allow_html=True
-                        )
-                    st.markdown("---")
-
-                    # pulisco il nome per lo storico (rimuovo prefissi tipo "[S] [NP] " ecc.)
-                    if scelta == "Nessuno":
-                        nome_pulito = "Nessuno"
-                    else:
-                        nome_pulito = (
-                            scelta.replace("[S] [NP] ", "")
-                                  .replace("[C] [NP] ", "")
-                                  .replace("[C] [USCITA] ", "")
-                                  .replace("[S] ", "")
-                                  .replace("[C] ", "")
-                                  .strip()
-                        )
-
-                    sostituzioni.append({
-                        "Ora": ora,
-                        "Classe": classe,
-                        "Assente": assente,
-                        "Sostituto_display": scelta,
-                        "Sostituto": nome_pulito
-                    })
-
-                sostituzioni_df = pd.DataFrame(sostituzioni)
-
-                # Ordina per ora
-                ordine_ore = ORE_LEZIONE
-                if not sostituzioni_df.empty:
-                    sostituzioni_df["Ora"] = pd.Categorical(sostituzioni_df["Ora"], categories=ordine_ore, ordered=True)
-                    sostituzioni_df = sostituzioni_df.sort_values("Ora").reset_index(drop=True)
-
-                tabella_df = sostituzioni_df[["Ora", "Classe", "Assente", "Sostituto_display"]].copy()
-                tabella_df = tabella_df.rename(columns={"Sostituto_display": "Sostituzione"})
-                tabella_df["Ora"] = pd.Categorical(tabella_df["Ora"], categories=ordine_ore, ordered=True)
-                tabella_df = tabella_df.sort_values(["Ora", "Classe"]).reset_index(drop=True)
-                st.subheader("📋 Riepilogo sostituzioni")
-
-                cards_html = ""
-                for ora_c, grp in tabella_df.groupby("Ora", sort=False):
-                    righe_html = ""
-                    for _, r in grp.iterrows():
-                        badge = _badge_sostituto(r["Sostituzione"])
-                        righe_html += (
-                            f'<div style="display:flex;justify-content:space-between;'
-                            f'align-items:center;padding:8px 0;border-bottom:1px solid #EFE6D3;">'
-                            f'<div><span style="font-weight:700;color:#3A2E1F;">Cl. {r["Classe"]}</span>'
-                            f'<span style="color:#9C5F2C;font-size:0.85em;margin-left:6px;">ass. {r["Assente"]}</span></div>'
-                            f'<div>{badge}</div></div>'
-                        )
-                    cards_html += (
-                        f'<div style="background:#FBF4E6;border:1.5px solid #E3D9C2;border-radius:14px;'
-                        f'padding:12px 14px;margin-bottom:10px;">'
-                        f'<div style="font-size:1em;font-weight:800;color:#C97D3D;margin-bottom:4px;">'
-                        f'🕐 {ora_c} ora</div>{righe_html}</div>'
-                    )
-                st.markdown(cards_html, unsafe_allow_html=True)
-
-                # --- VISTA TESTUALE ---
-                st.subheader("📝 Sostituzioni in formato testo (mobile/copincolla)")
-                testo_output = "Buongiorno, supplenze:\n\n"
-
-                # uso sostituzioni_df che ha sia display che nome pulito
-                for ora, gruppo in sostituzioni_df.groupby("Ora"):
-                    if not gruppo.empty:
-                        testo_output += f"🕐 *{ora} ORA*\n"
-                        for _, r in gruppo.iterrows():
-                            sost_pulito = r['Sostituto'] if r['Sostituto'] not in ["Nessuno", "", "—"] else "—"
-                            testo_output += f"Classe {r['Classe']}\n"
-                            testo_output += f"👩‍🏫 Assente: {r['Assente']}\n"
-                            testo_output += f"✅ Sostituzione: {sost_pulito}\n\n"
-
-                testo_strip = testo_output.strip()
-                st.text_area("Testo pronto da copiare", value=testo_strip, height=300)
-                # Bottone "Copia negli appunti" via JavaScript.
-                # json.dumps si occupa di tutto l'escaping (virgolette, backslash, a capo),
-                # evitando i replace manuali che non coprivano le virgolette doppie.
-                testo_json = json.dumps(testo_strip)
-                st.components.v1.html(f"""
-<button id="copia-sostituzioni-btn" style="
-    width:100%; padding:0.7em; font-size:1em; font-weight:bold;
-    background:#C97D3D; color:white; border:none; border-radius:10px; cursor:pointer;
-">📋 Copia negli appunti</button>
-<script>
-document.getElementById('copia-sostituzioni-btn').addEventListener('click', function() {{
-    navigator.clipboard.writeText({testo_json}).then(() => {{
-        this.innerText = '✅ Copiato!';
-        setTimeout(() => {{ this.innerText = '📋 Copia negli appunti'; }}, 2000);
-    }});
-}});
-</script>
-""", height=55)
-
-                # --- Riepilogo stampabile / PDF per la bacheca (v2.2) ---
-                st.subheader("🖨️ Riepilogo per la bacheca")
-                st.caption(
-                    "Apre una finestra pronta per la stampa. Dal dialogo di stampa del "
-                    "browser puoi scegliere una stampante fisica oppure \"Salva come PDF\"."
-                )
-                pulsante_stampa_sostituzioni(PLESSO_NAME, data_sostituzione, giorno_assente, tabella_df)
-
-                # --- Step 1: conferma (controllo conflitti) ---
-                if st.button("✅ Conferma tabella (non salva ancora)", type="primary"):
-                    check_df = sostituzioni_df.copy()
-                    conflitti = []
-                    conflitti_orario = []
-
-                    for ora_val in check_df["Ora"].unique():
-                        assegnazioni = check_df[check_df["Ora"] == ora_val]
-                        sostituti = [s for s in assegnazioni["Sostituto"] if s not in ["Nessuno", "", "—"]]
-
-                        # 1) Conflitto: stesso docente scelto su più classi nella stessa ora
-                        duplicati = [s for s in sostituti if sostituti.count(s) > 1]
-                        if duplicati:
-                            conflitti.append((ora_val, list(set(duplicati))))
-
-                        # 2) Conflitto: docente scelto ma già in orario in quell’ora (SOLO
-                        # curricolari, e solo se la sua classe in quell’ora NON è in uscita)
-                        for s in sostituti:
-                            # recupero il tipo del docente dalla mappa precalcolata
-                            tipo = docente_tipo_map.get(s, "").lower()
-                            if tipo != "sostegno":
-                                lezione_in_quell_ora = orario_df[
-                                    (orario_df["Docente"] == s) &
-                                    (orario_df["Giorno"] == giorno_assente) &
-                                    (orario_df["Ora"] == ora_val)
-                                ]
-                                if not lezione_in_quell_ora.empty:
-                                    classe_lezione = lezione_in_quell_ora.iloc[0]["Classe"]
-                                    classi_in_uscita_ora = classi_uscita_per_ora.get(ora_val, set())
-                                    if classe_lezione not in classi_in_uscita_ora:
-                                        conflitti_orario.append((ora_val, s))
-
-                    if conflitti or conflitti_orario:
-                        if conflitti:
-                            st.error("⚠️ Errore: lo stesso docente è stato assegnato a più classi nella stessa ora:")
-                            for ora_c, docs in conflitti:
-                                st.write(f"- Ora {ora_c}: {', '.join(docs)}")
-                        if conflitti_orario:
-                            st.error("⚠️ Errore: alcuni docenti curricolari scelti come supplenti hanno già lezione in quell’ora:")
-                            for ora_c, docente in conflitti_orario:
-                                st.write(f"- Ora {ora_c}: {docente} è già impegnato in orario")
-                        st.stop()
-
-                    # se tutto ok salvo in session_state
-                    st.session_state["sostituzioni_confermate"] = sostituzioni_df.copy()
-                    st.session_state["ore_assenti_confermate"] = ore_assenti.copy()
-                    st.session_state["data_sostituzione_tmp"] = data_sostituzione
-                    st.session_state["giorno_assente_tmp"] = giorno_assente
-
-                    st.success("Tabella confermata ✅ Ora puoi salvarla nello storico.")
-
-
-                # --- Step 2: Salva nello storico ---
-                if st.session_state.get("sostituzioni_confermate") is not None:
-                    if st.button("💾 Salva nello storico", key="save_storico_main", type="primary"):
-                        sost_df = st.session_state.get("sostituzioni_confermate")
-                        ore_assenti_session = st.session_state.get("ore_assenti_confermate")
-                        data_tmp = st.session_state.get("data_sostituzione_tmp")
-                        giorno_tmp = st.session_state.get("giorno_assente_tmp")
-
-                        if sost_df is not None and ore_assenti_session is not None:
-                            # salva_storico_assenze si aspetta la colonna "Sostituto" con il nome pulito
-                            if salva_storico_assenze(data_tmp, giorno_tmp, sost_df, ore_assenti_session):
-                                st.success("Assenze e sostituzioni salvate nello storico ✅")
-                                for k in ["sostituzioni_confermate", "ore_assenti_confermate",
-                                          "data_sostituzione_tmp", "giorno_assente_tmp"]:
-                                    st.session_state.pop(k, None)
-                                try:
-                                    st.rerun()
-                                except Exception:
-                                    pass
-
-
+        pianificazione_assenze(orario_df)
 
 
 
@@ -1422,21 +1865,10 @@ elif menu == "Visualizza Orario":
             "🔍 Filtra per docente (lascia vuoto per vedere tutti)",
             sorted(orario_df["Docente"].unique())
         )
-        if docenti_selezionati:
-            # Righe dei docenti selezionati
-            df_base = orario_df[orario_df["Docente"].isin(docenti_selezionati)]
-            # Compresenze: sostegni che operano nelle stesse classe+giorno+ora
-            chiavi = df_base[["Classe", "Giorno", "Ora"]].drop_duplicates()
-            df_compresenze = orario_df[
-                orario_df["Tipo"].str.lower() == "sostegno"
-            ].merge(chiavi, on=["Classe", "Giorno", "Ora"], how="inner")
-            df_filtrato = pd.concat([df_base, df_compresenze]).drop_duplicates()
-            if df_filtrato.empty:
-                st.warning("Nessun risultato.")
-            else:
-                vista_pivot_docenti(df_filtrato, mode="classi")
-        else:
-            vista_pivot_docenti(orario_df, mode="classi")
+        # Pivot precalcolate per versione: il filtro per docente ritaglia
+        # colonne e celle della vista completa (compresenze dei sostegni incluse)
+        viste = viste_orario(orario_df, versione_orario(orario_df))
+        vista_pivot_docenti(viste, mode="classi", docenti=docenti_selezionati)
         download_orario(orario_df)
 
 
@@ -1525,9 +1957,9 @@ elif menu == "Statistiche":
         # inclusi quelli a zero ore (non presenti nello storico)
         docenti_sostegno = set(
             orario_df[
-                (orario_df["Tipo"].str.lower() == "sostegno") &
+                righe_sostegno(orario_df) &
                 (~orario_df["Escludi"])
-            ]["Docente"].str.lower().unique()
+            ]["Docente"].astype(str).str.lower().unique()
         )
         df_tutti_sost = pd.DataFrame({"docente": sorted(docenti_sostegno)})
         df_tutti_sost = df_tutti_sost.merge(
@@ -1604,7 +2036,11 @@ elif menu == "Statistiche":
 
     st.subheader("Cloud Backup")
     st.info("Scarica un backup compresso dei dati dei fogli Orario, Storico e Assenze.")
-    backup_file = create_backup()
+    # Il backup si prepara solo su richiesta (non ad ogni cambio di filtro);
+    # una volta preparato resta disponibile finché i dati non cambiano.
+    if st.button("📦 Prepara backup", key="prepara_backup", type="secondary"):
+        st.session_state["backup_richiesto"] = True
+    backup_file = create_backup() if st.session_state.get("backup_richiesto") else None
     if backup_file:
         st.download_button(
             label="⬇️ Scarica Backup (ZIP)",
@@ -1644,3 +2080,53 @@ elif menu == "Statistiche":
                         f"archivio_assenze_{anno_input.strip().replace('/', '-')} "
                         f"sono ora disponibili nel documento Google."
                     )
+
+    # --- DIAGNOSTICA ACCESSI A GOOGLE ---
+    with st.expander("🛠️ Diagnostica accessi a Google Sheets"):
+        st.caption(
+            "Letture condivise dall'avvio del server: quando più persone chiedono "
+            "gli stessi fogli insieme parte una sola richiesta (miss) e le altre "
+            "ne aspettano il risultato (hit)."
+        )
+        contatori_letture = letture_condivise().contatori()
+        if not contatori_letture:
+            st.info("Nessuna lettura da Google dall'avvio del server.")
+        else:
+            # i contatori sono di processo: le chiavi sono (spreadsheet, foglio) di tutti i plessi
+            plesso_di = {p.spreadsheet_name: p.nome for p in PLESSI.values()}
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "Plesso": plesso_di.get(spreadsheet, spreadsheet),
+                        "Foglio": nome,
+                        "Richieste a Google (miss)": c["richieste"],
+                        "Condivise (hit)": c["condivise"],
+                        "Attesa media (s)": round(c["attesa_totale_s"] / c["condivise"], 2) if c["condivise"] else 0.0,
+                        "Attesa max (s)": round(c["attesa_max_s"], 2),
+                    }
+                    for (spreadsheet, nome), c in sorted(contatori_letture.items())
+                ]),
+                use_container_width=True, hide_index=True,
+            )
+
+        st.caption(
+            "Chiamate alle API di Google per metodo: i retry sono errori temporanei "
+            "(quota superata, 5xx) ritentati automaticamente; l'attesa per quota è "
+            "il tempo passato fermi per restare entro il limite al minuto."
+        )
+        contatori_api = ClientQuota.contatori()
+        if contatori_api:
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "Metodo": metodo,
+                        "Chiamate": c["chiamate"],
+                        "Unite a una già in corso": c["unite"],
+                        "Retry": c["retry"],
+                        "Errori": c["errori"],
+                        "Attesa per quota (s)": round(c["attesa_quota_s"], 1),
+                    }
+                    for metodo, c in sorted(contatori_api.items())
+                ]),
+                use_container_width=True, hide_index=True,
+            )
@@ -0,0 +1,500 @@
+"""Copia locale (SQLite) dei fogli Google orario, storico e assenze.
+
+Le letture dell'app passano da qui (millisecondi, nessuna chiamata di rete);
+le scritture finiscono prima qui e poi vengono inviate a Google da
+sincronizza(), che tiene traccia di cosa è già stato caricato:
+  - righe accodate (storico/assenze): colonna `sincronizzata` riga per riga;
+  - fogli riscritti per intero (orario, azzeramenti): `da_riscrivere` in meta.
+    In questo caso si inviano solo le differenze rispetto all'ultima copia
+    nota del foglio remoto (tabella `remoto`: numero di riga → valori), con
+    riscrittura completa solo se le differenze superano la tabella stessa.
+
+Google Sheets resta la fonte di verità per chi apre il foglio da browser:
+aggiorna_da_google() riallinea la copia locale quando serve.
+
+Ogni funzione apre una connessione breve: il modulo si può usare da più
+sessioni Streamlit e da thread diversi senza condividere oggetti sqlite3.
+L'invio a Google di uno stesso foglio è serializzato nel processo, così due
+thread non accodano due volte le stesse righe.
+"""
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import closing
+from typing import NamedTuple
+
+import pandas as pd
+
+
+def _connetti(percorso):
+    conn = sqlite3.connect(percorso, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+_lock_invio = defaultdict(threading.Lock)
+_lock_registro = threading.Lock()
+
+
+def _lock_foglio(percorso, foglio):
+    with _lock_registro:
+        return _lock_invio[(percorso, foglio)]
+
+
+def _q(nome):
+    """Quota un identificatore SQL (nomi di foglio e colonne sono costanti dell'app)."""
+    return '"' + nome.replace('"', '""') + '"'
+
+
+def inizializza(percorso, colonne_per_foglio):
+    """Crea il file e le tabelle mancanti. `colonne_per_foglio` è
+    {nome_foglio: [intestazioni]}, le stesse scritte nella riga 1 del foglio."""
+    os.makedirs(os.path.dirname(percorso) or ".", exist_ok=True)
+    with closing(_connetti(percorso)) as conn, conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta ("
+            " foglio TEXT PRIMARY KEY,"
+            " colonne TEXT NOT NULL,"
+            " versione INTEGER NOT NULL DEFAULT 0,"
+            " aggiornato_il REAL,"                       # ultimo allineamento da Google
+            " da_riscrivere INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS remoto ("
+            " foglio TEXT NOT NULL, riga INTEGER NOT NULL, valori TEXT NOT NULL,"
+            " PRIMARY KEY (foglio, riga))"
+        )
+        colonne_meta = {r[1] for r in conn.execute("PRAGMA table_info(meta)")}
+        if "remoto_valido" not in colonne_meta:
+            conn.execute("ALTER TABLE meta ADD COLUMN remoto_valido INTEGER NOT NULL DEFAULT 0")
+        for foglio, colonne in colonne_per_foglio.items():
+            colonne_sql = ", ".join(f"{_q(c)} TEXT" for c in colonne)
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {_q(foglio)} ("
+                f" id INTEGER PRIMARY KEY AUTOINCREMENT, {colonne_sql},"
+                f" sincronizzata INTEGER NOT NULL DEFAULT 1)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO meta (foglio, colonne) VALUES (?, ?)",
+                (foglio, "\x1f".join(colonne)),
+            )
+
+
+def _colonne(conn, foglio):
+    riga = conn.execute("SELECT colonne FROM meta WHERE foglio = ?", (foglio,)).fetchone()
+    return riga[0].split("\x1f")
+
+
+def _allinea(righe, n):
+    """Porta ogni riga a esattamente n celle di testo (Google omette le celle vuote finali)."""
+    return [[("" if v is None else str(v)) for v in list(r)[:n]] + [""] * (n - len(r)) for r in righe]
+
+
+def righe_da_valori(valori, colonne, con_numero=False):
+    """Converte la griglia di un foglio (riga 1 = intestazione) in righe
+    ordinate come `colonne`: le colonne mancanti restano vuote, quelle in
+    più vengono ignorate, le righe completamente vuote scartate.
+    Con con_numero=True restituisce coppie (numero di riga nel foglio, riga)."""
+    if not valori:
+        return []
+    intestazione = [str(h).strip() for h in valori[0]]
+    posizioni = [intestazione.index(c) if c in intestazione else None for c in colonne]
+    righe = []
+    for numero, r in enumerate(valori[1:], start=2):
+        riga = [("" if p is None or p >= len(r) else str(r[p])) for p in posizioni]
+        if any(v.strip() for v in riga):
+            righe.append((numero, riga) if con_numero else riga)
+    return righe
+
+
+def _incrementa_versione(conn, foglio):
+    conn.execute("UPDATE meta SET versione = versione + 1 WHERE foglio = ?", (foglio,))
+
+
+def leggi(percorso, foglio):
+    """DataFrame con i valori grezzi (stringhe) del foglio, nell'ordine delle righe."""
+    with closing(_connetti(percorso)) as conn:
+        colonne = _colonne(conn, foglio)
+        elenco = ", ".join(_q(c) for c in colonne)
+        return pd.read_sql_query(
+            f"SELECT {elenco} FROM {_q(foglio)} ORDER BY id", conn
+        ).astype(str)
+
+
+def versione(percorso, foglio):
+    """Numero che cresce ad ogni modifica della copia locale del foglio:
+    usato come chiave di cache dalle funzioni di lettura dell'app."""
+    with closing(_connetti(percorso)) as conn:
+        return conn.execute("SELECT versione FROM meta WHERE foglio = ?", (foglio,)).fetchone()[0]
+
+
+def ultimo_aggiornamento(percorso, foglio):
+    """Timestamp dell'ultimo allineamento da Google, None se mai fatto."""
+    with closing(_connetti(percorso)) as conn:
+        return conn.execute("SELECT aggiornato_il FROM meta WHERE foglio = ?", (foglio,)).fetchone()[0]
+
+
+def sostituisci(percorso, foglio, righe, da_google=False):
+    """Sostituisce tutte le righe del foglio locale.
+
+    da_google=True: le righe arrivano da Google (allineamento), quindi sono
+    già sincronizzate. Altrimenti il foglio va riscritto su Google al
+    prossimo sincronizza()."""
+    with closing(_connetti(percorso)) as conn, conn:
+        colonne = _colonne(conn, foglio)
+        conn.execute(f"DELETE FROM {_q(foglio)}")
+        conn.executemany(
+            f"INSERT INTO {_q(foglio)} ({', '.join(_q(c) for c in colonne)})"
+            f" VALUES ({', '.join('?' for _ in colonne)})",
+            _allinea(righe, len(colonne)),
+        )
+        if da_google:
+            conn.execute(
+                "UPDATE meta SET aggiornato_il = ?, da_riscrivere = 0 WHERE foglio = ?",
+                (time.time(), foglio),
+            )
+        else:
+            conn.execute("UPDATE meta SET da_riscrivere = 1 WHERE foglio = ?", (foglio,))
+        _incrementa_versione(conn, foglio)
+
+
+def accoda(percorso, foglio, righe):
+    """Aggiunge righe in coda al foglio locale, da inviare a Google."""
+    if not righe:
+        return
+    with closing(_connetti(percorso)) as conn, conn:
+        colonne = _colonne(conn, foglio)
+        conn.executemany(
+            f"INSERT INTO {_q(foglio)} ({', '.join(_q(c) for c in colonne)}, sincronizzata)"
+            f" VALUES ({', '.join('?' for _ in colonne)}, 0)",
+            _allinea(righe, len(colonne)),
+        )
+        _incrementa_versione(conn, foglio)
+
+
+# =========================
+# DIFFERENZE RISPETTO AL FOGLIO REMOTO
+# =========================
+class Differenze(NamedTuple):
+    aggiornamenti: list   # (riga, valori_vecchi, valori_nuovi) su righe già occupate
+    aggiunte: list        # (riga, valori) oltre l'ultima riga occupata
+    eliminazioni: list    # righe da togliere, in ordine crescente
+    layout: list          # (riga, valori) del foglio remoto dopo l'applicazione
+
+    @property
+    def costo(self):
+        return len(self.aggiornamenti) + len(self.aggiunte) + len(self.eliminazioni)
+
+
+def _chiave_cella(v):
+    """Confronto tollerante: il foglio restituisce i booleani formattati
+    (TRUE/FALSE, VERO/FALSO) mentre l'app scrive True/False."""
+    t = str(v).strip()
+    u = t.upper()
+    if u in ("TRUE", "VERO"):
+        return "TRUE"
+    if u in ("FALSE", "FALSO"):
+        return "FALSE"
+    return t
+
+
+def _chiave_riga(valori):
+    return tuple(_chiave_cella(v) for v in valori)
+
+
+def calcola_differenze(remoto, nuove):
+    """Confronta il foglio remoto `remoto` [(riga, valori)] con il contenuto
+    desiderato `nuove` [valori], a livello di riga e senza badare all'ordine.
+
+    Le righe identiche restano dove sono; le righe nuove occupano prima le
+    posizioni rimaste libere (aggiornamenti), poi vanno in coda (aggiunte);
+    le posizioni libere avanzate vengono eliminate."""
+    disponibili = defaultdict(deque)
+    for riga, valori in sorted(remoto):
+        disponibili[_chiave_riga(valori)].append(riga)
+
+    layout = {}
+    da_collocare = []
+    for valori in nuove:
+        righe = disponibili.get(_chiave_riga(valori))
+        if righe:
+            riga = righe.popleft()
+            layout[riga] = list(valori)
+        else:
+            da_collocare.append(list(valori))
+
+    vecchi = dict(remoto)
+    libere = sorted(r for righe in disponibili.values() for r in righe)
+    n = min(len(libere), len(da_collocare))
+    aggiornamenti = [(riga, list(vecchi[riga]), valori) for riga, valori in zip(libere, da_collocare)]
+    eliminazioni = libere[n:]
+    ultima = max(vecchi, default=1)
+    aggiunte = [(ultima + 1 + i, valori) for i, valori in enumerate(da_collocare[n:])]
+
+    for riga, _, valori in aggiornamenti:
+        layout[riga] = valori
+    for riga, valori in aggiunte:
+        layout[riga] = valori
+    # le eliminazioni fanno risalire le righe sottostanti
+    spostate = [
+        (riga - bisect_left(eliminazioni, riga), valori)
+        for riga, valori in sorted(layout.items())
+    ]
+    return Differenze(aggiornamenti, aggiunte, eliminazioni, spostate)
+
+
+def _colonna_a1(n):
+    """1 → A, 27 → AA."""
+    lettere = ""
+    while n:
+        n, resto = divmod(n - 1, 26)
+        lettere = chr(ord("A") + resto) + lettere
+    return lettere
+
+
+def _applica_differenze(ws, diff, n_colonne):
+    """Invia a Google le sole differenze: una values.batchUpdate per celle
+    cambiate e righe aggiunte (più add_rows se la griglia è troppo corta) e
+    una batchUpdate di deleteDimension per le righe tolte."""
+    intervalli = []
+    for riga, vecchi, nuovi in diff.aggiornamenti:
+        cambiate = [i for i in range(n_colonne) if _chiave_cella(vecchi[i]) != _chiave_cella(nuovi[i])]
+        if not cambiate:
+            continue
+        da, a = cambiate[0], cambiate[-1]
+        intervalli.append({
+            "range": f"{_colonna_a1(da + 1)}{riga}:{_colonna_a1(a + 1)}{riga}",
+            "values": [nuovi[da:a + 1]],
+        })
+    if diff.aggiunte:
+        prima, ultima = diff.aggiunte[0][0], diff.aggiunte[-1][0]
+        if ultima > ws.row_count:
+            ws.add_rows(ultima - ws.row_count)
+        intervalli.append({
+            "range": f"A{prima}:{_colonna_a1(n_colonne)}{ultima}",
+            "values": [valori for _, valori in diff.aggiunte],
+        })
+    if intervalli:
+        ws.batch_update(intervalli, value_input_option="USER_ENTERED")
+
+    if diff.eliminazioni:
+        # blocchi di righe contigue, dal basso verso l'alto così gli indici restano validi
+        blocchi = []
+        for riga in diff.eliminazioni:
+            if blocchi and blocchi[-1][1] == riga - 1:
+                blocchi[-1][1] = riga
+            else:
+                blocchi.append([riga, riga])
+        ws.spreadsheet.batch_update({"requests": [
+            {"deleteDimension": {"range": {
+                "sheetId": ws.id, "dimension": "ROWS",
+                "startIndex": inizio - 1, "endIndex": fine,
+            }}}
+            for inizio, fine in reversed(blocchi)
+        ]})
+
+
+def _leggi_remoto(conn, foglio):
+    valido = conn.execute("SELECT remoto_valido FROM meta WHERE foglio = ?", (foglio,)).fetchone()[0]
+    if not valido:
+        return None
+    return [
+        (riga, valori.split("\x1f"))
+        for riga, valori in conn.execute(
+            "SELECT riga, valori FROM remoto WHERE foglio = ? ORDER BY riga", (foglio,)
+        )
+    ]
+
+
+def _salva_remoto(conn, foglio, layout):
+    """Memorizza la disposizione del foglio remoto; layout=None la invalida
+    (es. dopo un append, di cui Google sceglie la posizione)."""
+    conn.execute("DELETE FROM remoto WHERE foglio = ?", (foglio,))
+    if layout is None:
+        conn.execute("UPDATE meta SET remoto_valido = 0 WHERE foglio = ?", (foglio,))
+        return
+    conn.executemany(
+        "INSERT INTO remoto (foglio, riga, valori) VALUES (?, ?, ?)",
+        [(foglio, riga, "\x1f".join(str(v) for v in valori)) for riga, valori in layout],
+    )
+    conn.execute("UPDATE meta SET remoto_valido = 1 WHERE foglio = ?", (foglio,))
+
+
+def _in_sospeso(conn, foglio):
+    da_riscrivere = conn.execute(
+        "SELECT da_riscrivere FROM meta WHERE foglio = ?", (foglio,)
+    ).fetchone()[0]
+    righe = conn.execute(
+        f"SELECT COUNT(*) FROM {_q(foglio)} WHERE sincronizzata = 0"
+    ).fetchone()[0]
+    return bool(da_riscrivere) or righe > 0
+
+
+def in_sospeso(percorso, foglio):
+    """True se il foglio ha modifiche locali non ancora inviate a Google."""
+    with closing(_connetti(percorso)) as conn:
+        return _in_sospeso(conn, foglio)
+
+
+def righe_in_sospeso(percorso, foglio):
+    """Numero di righe accodate e non ancora inviate a Google."""
+    with closing(_connetti(percorso)) as conn:
+        return conn.execute(
+            f"SELECT COUNT(*) FROM {_q(foglio)} WHERE sincronizzata = 0"
+        ).fetchone()[0]
+
+
+def sincronizza(percorso, fogli, apri_foglio):
+    """Invia a Google le modifiche locali in sospeso dei fogli indicati.
+
+    `apri_foglio(nome)` restituisce il worksheet gspread. Un foglio da
+    riscrivere viene svuotato e riscritto (intestazione + righe); altrimenti
+    si accodano solo le righe non ancora sincronizzate. Le righe vengono
+    segnate come inviate solo dopo la risposta positiva di Google: se la
+    chiamata fallisce restano in sospeso e si riprova alla prossima volta."""
+    for foglio in fogli:
+        with _lock_foglio(percorso, foglio):
+            _sincronizza_foglio(percorso, foglio, apri_foglio)
+
+
+def _sincronizza_foglio(percorso, foglio, apri_foglio):
+    with closing(_connetti(percorso)) as conn:
+        colonne = _colonne(conn, foglio)
+        remoto = _leggi_remoto(conn, foglio)
+        da_riscrivere, versione_letta = conn.execute(
+            "SELECT da_riscrivere, versione FROM meta WHERE foglio = ?", (foglio,)
+        ).fetchone()
+        elenco = ", ".join(_q(c) for c in colonne)
+        if da_riscrivere:
+            righe = conn.execute(f"SELECT id, {elenco} FROM {_q(foglio)} ORDER BY id").fetchall()
+        else:
+            righe = conn.execute(
+                f"SELECT id, {elenco} FROM {_q(foglio)} WHERE sincronizzata = 0 ORDER BY id"
+            ).fetchall()
+    if not da_riscrivere and not righe:
+        return
+
+    ws = apri_foglio(foglio)
+    valori = [list(r[1:]) for r in righe]
+    # l'invio può richiedere più chiamate: se si interrompe a metà il foglio
+    # remoto non corrisponde più alla copia nota, e il prossimo invio deve
+    # riscrivere tutto invece di calcolare differenze su una disposizione vecchia
+    with closing(_connetti(percorso)) as conn, conn:
+        _salva_remoto(conn, foglio, None)
+    if da_riscrivere:
+        diff = calcola_differenze(remoto, valori) if remoto is not None else None
+        if diff is not None and diff.costo <= len(valori):
+            _applica_differenze(ws, diff, len(colonne))
+            layout = diff.layout
+        else:
+            # nessuna copia nota del foglio remoto, o differenze più grandi
+            # della tabella: conviene riscrivere tutto
+            ws.clear()
+            ws.update(values=[colonne] + valori, range_name="A1", value_input_option="USER_ENTERED")
+            layout = list(enumerate(valori, start=2))
+    else:
+        ws.append_rows(valori, value_input_option="USER_ENTERED")
+        layout = None
+
+    with closing(_connetti(percorso)) as conn, conn:
+        ultimo_id = righe[-1][0] if righe else 0
+        conn.execute(
+            f"UPDATE {_q(foglio)} SET sincronizzata = 1 WHERE sincronizzata = 0 AND id <= ?",
+            (ultimo_id,),
+        )
+        _salva_remoto(conn, foglio, layout)
+        if da_riscrivere:
+            # se nel frattempo il foglio è stato riscritto di nuovo, resta in sospeso
+            conn.execute(
+                "UPDATE meta SET da_riscrivere = 0 WHERE foglio = ? AND versione = ?",
+                (foglio, versione_letta),
+            )
+
+
+def archivia_e_svuota(percorso, fogli, apri_foglio, svuota_remoto):
+    """Svuota i fogli su Google e nella copia locale, dopo averli archiviati.
+
+    Sotto il lock d'invio dei fogli: invia le modifiche in sospeso (vedi
+    sincronizza), poi chiama `svuota_remoto()`, che su Google copia e
+    svuota i fogli con una sola richiesta. Solo se questa va a buon fine
+    si tolgono dalla copia locale le righe già inviate, senza bisogno di
+    riallinearsi: il foglio remoto ora ha la sola intestazione. Le righe
+    accodate nel frattempo restano in sospeso e finiranno nel foglio nuovo."""
+    # sempre nello stesso ordine, per non incrociarsi con un altro archivia_e_svuota
+    lock_fogli = [_lock_foglio(percorso, foglio) for foglio in sorted(set(fogli))]
+    for lock in lock_fogli:
+        lock.acquire()
+    try:
+        for foglio in fogli:
+            _sincronizza_foglio(percorso, foglio, apri_foglio)
+        risultato = svuota_remoto()
+        with closing(_connetti(percorso)) as conn, conn:
+            for foglio in fogli:
+                da_riscrivere = conn.execute(
+                    "SELECT da_riscrivere FROM meta WHERE foglio = ?", (foglio,)
+                ).fetchone()[0]
+                # se nel frattempo il foglio è stato riscritto in locale, quello
+                # resta il contenuto voluto: va solo inviato al foglio vuoto
+                if not da_riscrivere:
+                    conn.execute(f"DELETE FROM {_q(foglio)} WHERE sincronizzata = 1")
+                conn.execute("UPDATE meta SET aggiornato_il = ? WHERE foglio = ?", (time.time(), foglio))
+                _salva_remoto(conn, foglio, [])
+                _incrementa_versione(conn, foglio)
+        return risultato
+    finally:
+        for lock in reversed(lock_fogli):
+            lock.release()
+
+
+def aggiorna_da_google(percorso, fogli, leggi_valori):
+    """Riallinea la copia locale con i fogli letti da Google.
+
+    `leggi_valori(fogli)` restituisce {foglio: griglia di valori} e deve
+    leggere tutti i fogli richiesti in un colpo solo (values:batchGet).
+    I fogli con modifiche locali ancora in sospeso non vengono chiesti né
+    toccati, per non perdere scritture non ancora inviate. Restituisce
+    l'elenco dei fogli effettivamente aggiornati.
+
+    Lettura e sostituzione avvengono sotto il lock d'invio dei fogli (un
+    invio a metà non si mescola alla lettura), e le modifiche locali
+    arrivate durante la lettura si ricontrollano nella stessa transazione
+    che sostituisce le righe: in quel caso il foglio resta com'è."""
+    da_leggere = [f for f in fogli if not in_sospeso(percorso, f)]
+    if not da_leggere:
+        return []
+    lock_fogli = [_lock_foglio(percorso, foglio) for foglio in sorted(set(da_leggere))]
+    for lock in lock_fogli:
+        lock.acquire()
+    try:
+        griglie = leggi_valori(da_leggere)
+        aggiornati = []
+        for foglio in da_leggere:
+            valori = griglie.get(foglio, [])
+            with closing(_connetti(percorso)) as conn, conn:
+                # BEGIN IMMEDIATE: da qui a fine transazione nessun accoda() o
+                # sostituisci() può infilarsi tra il controllo e la sostituzione
+                conn.execute("BEGIN IMMEDIATE")
+                if _in_sospeso(conn, foglio):
+                    continue
+                colonne = _colonne(conn, foglio)
+                numerate = righe_da_valori(valori, colonne, con_numero=True)
+                conn.execute(f"DELETE FROM {_q(foglio)} WHERE sincronizzata = 1")
+                conn.executemany(
+                    f"INSERT INTO {_q(foglio)} ({', '.join(_q(c) for c in colonne)})"
+                    f" VALUES ({', '.join('?' for _ in colonne)})",
+                    _allinea([r for _, r in numerate], len(colonne)),
+                )
+                conn.execute("UPDATE meta SET aggiornato_il = ? WHERE foglio = ?", (time.time(), foglio))
+                _incrementa_versione(conn, foglio)
+                # la disposizione remota è affidabile solo se le colonne sono
+                # esattamente le nostre, nello stesso ordine, a partire da A
+                intestazione_ok = bool(valori) and [str(h).strip() for h in valori[0][:len(colonne)]] == colonne
+                _salva_remoto(conn, foglio, numerate if intestazione_ok else None)
+            aggiornati.append(foglio)
+        return aggiornati
+    finally:
+        for lock in reversed(lock_fogli):
+            lock.release()
@@ -0,0 +1,246 @@
+"""Benchmark del motore delle sostituzioni su scuole sintetiche.
+
+Genera orari realistici (curricolari + sostegni, nessun docente in due
+classi nella stessa ora) di dimensione crescente e misura la latenza di:
+  - costruisci_indice          (una volta per versione dell'orario)
+  - pianifica_sostituzioni     (ad ogni rerun della pagina Gestione Assenze),
+                               ora per ora e con la pianificazione della giornata
+  - vista classi               (Visualizza Orario, una volta per versione)
+  - giornata pesante           almeno ORE_GIORNATA_PESANTE ore scoperte nello
+                               stesso giorno con "Max ore di fila" = 1, il caso
+                               in cui la ricerca esatta si ferma e interviene
+                               l'euristica: deve restare sotto BUDGET_GIORNATA_MS
+
+La vista classi viene anche controllata: dall'orario compatto deve uscire
+una riga per ogni ora della settimana più i separatori tra i giorni, e la
+vista filtrata per docente deve coincidere, anche nell'ordine dei nomi
+dentro le celle, con quella ottenuta pivotando le sole righe filtrate.
+
+Uso:
+    python benchmark_sostituzioni.py                 # griglia completa
+    python benchmark_sostituzioni.py --rapido        # solo scuola piccola/media
+    python benchmark_sostituzioni.py --soglia-ms 50  # esce con codice 1 se il
+                                                     # rerun supera i 50 ms (p95)
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+from motore_sostituzioni import (
+    GIORNI_SETTIMANA, ORE_LEZIONE, TEMPO_MAX_GIORNATA_S, LimitiGiornata, _ordine_classe,
+    celle_per_classe, classi_per_docente, compatta_orario, costruisci_indice,
+    formatta_vista_classi, pianifica_sostituzioni, vista_classi, vista_classi_filtrata,
+)
+
+# (docenti, classi): dalla scuola dell'infanzia al comprensivo grande
+SCENARI = [(50, 10), (150, 25), (300, 40), (600, 80), (1000, 120)]
+SCENARI_RAPIDI = [(50, 10), (150, 25)]
+ASSENTI = [1, 5, 10, 20]
+ORE_GIORNATA_PESANTE = 45
+LIMITI_PESANTI = LimitiGiornata(max_sostituzioni=6, max_consecutive=1)
+# p95 massimo per la giornata pesante: il tetto del motore più un margine
+# per preparare le righe e per l'ultimo flusso avviato prima della scadenza
+BUDGET_GIORNATA_MS = TEMPO_MAX_GIORNATA_S * 1000 + 200
+
+
+def genera_scuola(n_docenti, n_classi, quota_sostegno=0.2, quota_esclusi=0.02, seed=0):
+    """Orario sintetico con le stesse colonne di carica_orario().
+
+    Ogni classe ha lezione in tutte le ore della settimana; i curricolari
+    si dividono le ore delle classi, i sostegni affiancano le classi in
+    ore sparse. Un docente non compare mai due volte nella stessa ora."""
+    rng = random.Random(seed)
+    n_sostegno = max(1, int(n_docenti * quota_sostegno))
+    curricolari = [f"Curricolare {i:04d}" for i in range(n_docenti - n_sostegno)]
+    sostegni = [f"Sostegno {i:04d}" for i in range(n_sostegno)]
+    classi = [f"{1 + i % 5}{chr(ord('A') + i // 5)}" for i in range(n_classi)]
+    esclusi = set(rng.sample(curricolari + sostegni, int(n_docenti * quota_esclusi)))
+
+    ore_settimana = len(GIORNI_SETTIMANA) * len(ORE_LEZIONE)
+    budget = {d: max(2, -(-n_classi * ore_settimana // len(curricolari))) for d in curricolari}
+    ore_sostegno = min(18, ore_settimana)
+
+    righe = []
+    for giorno in GIORNI_SETTIMANA:
+        for ora in ORE_LEZIONE:
+            liberi = [d for d in curricolari if budget[d] > 0]
+            rng.shuffle(liberi)
+            for classe, docente in zip(classi, liberi):
+                budget[docente] -= 1
+                righe.append((docente, giorno, ora, classe, "Lezione", docente in esclusi))
+    slot_tutti = [(g, o) for g in GIORNI_SETTIMANA for o in ORE_LEZIONE]
+    for docente in sostegni:
+        for giorno, ora in rng.sample(slot_tutti, ore_sostegno):
+            righe.append((docente, giorno, ora, rng.choice(classi), "Sostegno", docente in esclusi))
+
+    return compatta_orario(pd.DataFrame(righe, columns=["Docente", "Giorno", "Ora", "Classe", "Tipo", "Escludi"]))
+
+
+def _misura(funzione, ripetizioni):
+    tempi = []
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        funzione()
+        tempi.append((time.perf_counter() - t0) * 1000)
+    tempi.sort()
+    p95 = tempi[min(len(tempi) - 1, int(round(0.95 * (len(tempi) - 1))))]
+    return statistics.median(tempi), p95
+
+
+def vista_filtrata_da_righe(orario_df, docenti):
+    """Vista per classi filtrata costruita come faceva la pagina prima delle
+    viste precalcolate: righe dei docenti scelti più i sostegni in
+    compresenza, poi pivot con i nomi nell'ordine delle righe."""
+    df = orario_df.astype({c: str for c in ["Docente", "Giorno", "Ora", "Classe", "Tipo"]})
+    df_base = df[df["Docente"].isin(docenti)]
+    chiavi = df_base[["Classe", "Giorno", "Ora"]].drop_duplicates()
+    df_compresenze = df[df["Tipo"].str.lower() == "sostegno"].merge(chiavi, on=["Classe", "Giorno", "Ora"], how="inner")
+    df_filtrato = pd.concat([df_base, df_compresenze]).drop_duplicates()
+    pivot = df_filtrato.pivot_table(
+        index=["Giorno", "Ora"], columns="Classe", values="Docente",
+        aggfunc=lambda x: " / ".join(dict.fromkeys(x)),
+    )
+    return formatta_vista_classi(pivot.reindex(sorted(pivot.columns, key=_ordine_classe), axis=1))
+
+
+def controlla_vista_classi(orario_df, seed=0):
+    """Costruisce la vista classi dall'orario compatto e ne verifica la forma;
+    restituisce l'elenco dei problemi trovati (vuoto se è tutto a posto)."""
+    vista = vista_classi(celle_per_classe(orario_df))
+    problemi = []
+    attese = len(GIORNI_SETTIMANA) * len(ORE_LEZIONE) + len(GIORNI_SETTIMANA) - 1
+    if len(vista) != attese:
+        problemi.append(f"vista classi con {len(vista)} righe invece di {attese}")
+    if list(vista["Giorno"][vista["Giorno"].isin(GIORNI_SETTIMANA)]) != GIORNI_SETTIMANA:
+        problemi.append("vista classi: giorni mancanti o ripetuti")
+    if (vista["Giorno"] == "──").sum() != len(GIORNI_SETTIMANA) - 1:
+        problemi.append("vista classi: separatori tra i giorni mancanti")
+
+    # righe mescolate: nel foglio vero l'ordine non segue docenti e ore, ed
+    # è proprio l'ordine delle righe a decidere quello dei nomi nelle celle
+    mescolato = orario_df.sample(frac=1, random_state=seed).reset_index(drop=True)
+    celle = celle_per_classe(mescolato)
+    classi_docente = classi_per_docente(mescolato)
+    rng = random.Random(seed)
+    curricolari = sorted(mescolato.loc[~mescolato["is_sostegno"], "Docente"].unique())
+    sostegni = sorted(mescolato.loc[mescolato["is_sostegno"], "Docente"].unique())
+    for docenti in (rng.sample(curricolari, 1), rng.sample(sostegni, 1),
+                    rng.sample(curricolari, 2) + rng.sample(sostegni, 2)):
+        attesa = vista_filtrata_da_righe(mescolato, docenti)
+        filtrata = vista_classi_filtrata(celle, classi_docente, docenti)
+        if not filtrata.equals(attesa):
+            problemi.append(f"vista classi filtrata per {', '.join(docenti)} diversa da quella dalle righe")
+    return problemi
+
+
+def assenti_giornata_pesante(orario_df, giorno_data, seed=0):
+    """Assenti scelti a caso, aggiunti uno alla volta finché le ore scoperte
+    del giorno arrivano ad almeno ORE_GIORNATA_PESANTE (o finiscono i docenti)."""
+    docenti = sorted(orario_df["Docente"].unique())
+    random.Random(seed).shuffle(docenti)
+    giorno = orario_df["Giorno"] == giorno_data
+    ore_per_docente = orario_df[giorno].groupby("Docente", observed=True).size()
+    assenti, ore = [], 0
+    for docente in docenti:
+        if ore >= ORE_GIORNATA_PESANTE:
+            break
+        assenti.append(docente)
+        ore += int(ore_per_docente.get(docente, 0))
+    return assenti
+
+
+def esegui(scenari, ripetizioni, seed=0):
+    # Un lunedì qualsiasi: tutti i giorni della settimana hanno lo stesso carico
+    lunedi = date(2025, 1, 6)
+    risultati = []
+    for n_docenti, n_classi in scenari:
+        orario_df = genera_scuola(n_docenti, n_classi, seed=seed)
+        med_idx, p95_idx = _misura(lambda: costruisci_indice(orario_df), max(3, ripetizioni // 5))
+        indice = costruisci_indice(orario_df)
+        med_viste, _ = _misura(lambda: vista_classi(celle_per_classe(orario_df)), max(3, ripetizioni // 5))
+        problemi = controlla_vista_classi(orario_df, seed)
+        assenti_pesanti = assenti_giornata_pesante(orario_df, GIORNI_SETTIMANA[0], seed)
+        ore_pesanti = len(pianifica_sostituzioni(
+            orario_df, lunedi, assenti_pesanti, {}, indice=indice, limiti=LIMITI_PESANTI
+        ).righe)
+        _, p95_pesante = _misura(
+            lambda: pianifica_sostituzioni(
+                orario_df, lunedi, assenti_pesanti, {}, indice=indice, limiti=LIMITI_PESANTI
+            ),
+            max(3, ripetizioni // 5),
+        )
+        if p95_pesante > BUDGET_GIORNATA_MS:
+            problemi.append(
+                f"giornata pesante ({ore_pesanti} ore, max 1 di fila) in {p95_pesante:.0f} ms,"
+                f" oltre {BUDGET_GIORNATA_MS:.0f} ms"
+            )
+        rng = random.Random(seed)
+        # ore di sostituzione già svolte, come arrivano dallo storico
+        carico = {d.lower(): rng.randrange(30) for d in indice.docenti}
+        for n_assenti in ASSENTI:
+            giorno_data = lunedi + timedelta(days=rng.randrange(len(GIORNI_SETTIMANA)))
+            assenti = rng.sample(sorted(orario_df["Docente"].unique()), min(n_assenti, n_docenti))
+            uscita = {ora: set(rng.sample(sorted(orario_df["Classe"].unique()), 1)) for ora in ORE_LEZIONE[:2]}
+            ore_scoperte = len(pianifica_sostituzioni(
+                orario_df, giorno_data, assenti, uscita, indice=indice, carico=carico
+            ).righe)
+            med, p95 = _misura(
+                lambda: pianifica_sostituzioni(
+                    orario_df, giorno_data, assenti, uscita, indice=indice, carico=carico
+                ),
+                ripetizioni,
+            )
+            med_g, p95_g = _misura(
+                lambda: pianifica_sostituzioni(
+                    orario_df, giorno_data, assenti, uscita, indice=indice, carico=carico,
+                    limiti=LimitiGiornata(),
+                ),
+                ripetizioni,
+            )
+            risultati.append({
+                "docenti": n_docenti, "classi": n_classi, "righe orario": len(orario_df),
+                "assenti": n_assenti, "ore scoperte": ore_scoperte,
+                "indice ms (med)": round(med_idx, 2), "indice ms (p95)": round(p95_idx, 2),
+                "viste ms (med)": round(med_viste, 2),
+                "pesante ore": ore_pesanti, "pesante ms (p95)": round(p95_pesante, 2),
+                "problemi": "; ".join(problemi),
+                "rerun ms (med)": round(med, 2), "rerun ms (p95)": round(p95, 2),
+                "giornata ms (med)": round(med_g, 2), "giornata ms (p95)": round(p95_g, 2),
+            })
+    return pd.DataFrame(risultati)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rapido", action="store_true", help="solo gli scenari piccoli")
+    parser.add_argument("--ripetizioni", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--soglia-ms", type=float, default=None,
+                        help="latenza massima (p95) accettata per un rerun")
+    args = parser.parse_args(argv)
+
+    risultati = esegui(SCENARI_RAPIDI if args.rapido else SCENARI, args.ripetizioni, args.seed)
+    print(risultati.to_string(index=False))
+
+    errati = risultati[risultati["problemi"] != ""]
+    if not errati.empty:
+        print(f"\nERRORE: {errati['problemi'].iloc[0]}", file=sys.stderr)
+        return 1
+
+    if args.soglia_ms is not None:
+        lenti = risultati[
+            (risultati["rerun ms (p95)"] > args.soglia_ms) | (risultati["giornata ms (p95)"] > args.soglia_ms)
+        ]
+        if not lenti.empty:
+            print(f"\nREGRESSIONE: {len(lenti)} scenari oltre {args.soglia_ms} ms (p95)", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
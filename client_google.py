@@ -0,0 +1,150 @@
+"""Client HTTP per gspread che rispetta le quote di Google Sheets.
+
+Si passa a gspread.authorize(..., http_client=ClientQuota): ogni chiamata
+dell'app fatta con gspread passa da qui e ottiene:
+  - un limitatore a secchiello di token per letture e scritture, tarato
+    sulla quota "per minuto per utente" di Sheets (60 + 60 al minuto);
+  - retry con attesa esponenziale e jitter sugli errori transitori
+    (429 quota superata, 5xx, connessione caduta), rispettando Retry-After.
+    Le scritture si ritentano solo dopo un 429: con un 5xx o una risposta
+    persa Google può averle già applicate, e ripeterle duplicherebbe le
+    righe accodate o cancellerebbe righe già spostate;
+  - richieste GET identiche contemporanee unite in una sola (single-flight);
+  - contatori per metodo API (chiamate, retry, errori, attesa per quota).
+
+Così i picchi (archiviazione di fine anno, molte modifiche all'orario)
+rallentano invece di fallire con un errore all'utente.
+"""
+import random
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import requests
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+
+from richieste_condivise import VoloSingolo
+
+LETTURE_AL_MINUTO = 60
+SCRITTURE_AL_MINUTO = 60
+RAFFICA = 20                    # token disponibili subito dopo un periodo di quiete
+TENTATIVI_MASSIMI = 6
+ATTESA_BASE_S = 1.0
+ATTESA_MASSIMA_S = 32.0
+STATUS_RITENTABILI = {429, 500, 502, 503, 504}
+STATUS_RITENTABILI_SCRITTURE = {429}    # richiesta rifiutata, sicuramente non applicata
+
+
+class SecchielloToken:
+    """Token bucket: `al_minuto` token ricaricati in modo continuo, al
+    massimo `capacita` accumulabili. preleva() blocca finché c'è un token."""
+
+    def __init__(self, al_minuto, capacita):
+        self.ricarica_al_secondo = al_minuto / 60.0
+        self.capacita = float(capacita)
+        self._token = float(capacita)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def preleva(self):
+        """Consuma un token; restituisce i secondi passati ad aspettarlo."""
+        attesa_totale = 0.0
+        while True:
+            with self._lock:
+                adesso = time.monotonic()
+                self._token = min(self.capacita, self._token + (adesso - self._ultimo) * self.ricarica_al_secondo)
+                self._ultimo = adesso
+                if self._token >= 1:
+                    self._token -= 1
+                    return attesa_totale
+                attesa = (1 - self._token) / self.ricarica_al_secondo
+            time.sleep(attesa)
+            attesa_totale += attesa
+
+
+def nome_metodo(method, endpoint):
+    """Nome leggibile del metodo API a partire dall'URL, per i contatori:
+    es. "values:batchGet", "values:append", "batchUpdate", "metadata"."""
+    percorso = urlparse(endpoint).path
+    if "/drive/" in percorso:
+        return f"drive.{method.lower()}"
+    ultimo = percorso.rstrip("/").rsplit("/", 1)[-1]
+    azione = ultimo.rsplit(":", 1)[1] if ":" in ultimo else None
+    if "/values" in percorso:
+        return f"values:{azione or method.lower()}"
+    return azione or ("metadata" if method.upper() == "GET" else method.lower())
+
+
+def _attesa_retry(tentativo, risposta=None):
+    """Attesa esponenziale con jitter ("full jitter"); se Google indica
+    Retry-After si aspetta almeno quello."""
+    attesa = random.uniform(0, min(ATTESA_MASSIMA_S, ATTESA_BASE_S * 2 ** tentativo))
+    if risposta is not None:
+        try:
+            attesa = max(attesa, float(risposta.headers.get("Retry-After", 0)))
+        except (TypeError, ValueError):
+            pass
+    return attesa
+
+
+class ClientQuota(HTTPClient):
+    # Condivisi da tutti i client del processo: la quota è per service account
+    letture = SecchielloToken(LETTURE_AL_MINUTO, RAFFICA)
+    scritture = SecchielloToken(SCRITTURE_AL_MINUTO, RAFFICA)
+    volo = VoloSingolo()
+    _lock_contatori = threading.Lock()
+    _contatori = defaultdict(lambda: {
+        "chiamate": 0, "unite": 0, "retry": 0, "errori": 0, "attesa_quota_s": 0.0,
+    })
+
+    @classmethod
+    def _conta(cls, metodo, **incrementi):
+        with cls._lock_contatori:
+            c = cls._contatori[metodo]
+            for campo, valore in incrementi.items():
+                c[campo] += valore
+
+    @classmethod
+    def contatori(cls):
+        """Copia dei contatori: {metodo: {chiamate, unite, retry, errori, attesa_quota_s}}."""
+        with cls._lock_contatori:
+            return {metodo: dict(c) for metodo, c in cls._contatori.items()}
+
+    def request(self, method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+        metodo = nome_metodo(method, endpoint)
+        esegui = lambda: self._con_retry(metodo, method, endpoint, params, data, json, files, headers)
+        if method.upper() == "GET" and data is None and json is None and files is None:
+            chiave = (endpoint, repr(sorted((params or {}).items())))
+            eseguita = []
+            risposta = self.volo.esegui(chiave, lambda: eseguita.append(1) or esegui())
+            if not eseguita:
+                self._conta(metodo, unite=1)
+            return risposta
+        return esegui()
+
+    def _con_retry(self, metodo, method, endpoint, params, data, json, files, headers):
+        lettura = method.upper() == "GET"
+        secchiello = self.letture if lettura else self.scritture
+        ritentabili = STATUS_RITENTABILI if lettura else STATUS_RITENTABILI_SCRITTURE
+        for tentativo in range(TENTATIVI_MASSIMI):
+            self._conta(metodo, chiamate=1, attesa_quota_s=secchiello.preleva())
+            try:
+                return super().request(
+                    method, endpoint, params=params, data=data, json=json, files=files, headers=headers
+                )
+            except APIError as e:
+                risposta = getattr(e, "response", None)
+                status = getattr(risposta, "status_code", None)
+                if status not in ritentabili or tentativo == TENTATIVI_MASSIMI - 1:
+                    self._conta(metodo, errori=1)
+                    raise
+                attesa = _attesa_retry(tentativo, risposta)
+            except (requests.ConnectionError, requests.Timeout):
+                if not lettura or tentativo == TENTATIVI_MASSIMI - 1:
+                    self._conta(metodo, errori=1)
+                    raise
+                attesa = _attesa_retry(tentativo)
+            self._conta(metodo, retry=1)
+            time.sleep(attesa)
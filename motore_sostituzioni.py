@@ -0,0 +1,814 @@
+"""Motore delle sostituzioni: calcola, per ogni ora scoperta, la lista
+ordinata dei possibili sostituti e il sostituto proposto.
+
+Non dipende da Streamlit: app.py lo usa per la pagina "Gestione Assenze"
+(e per le tabelle di "Visualizza Orario"), benchmark_sostituzioni.py per
+misurarne i tempi su scuole sintetiche.
+
+Ordine dei candidati per ogni ora (invariato rispetto alla versione inline):
+  1) [S]           sostegni della stessa classe
+  2) [S]           altri sostegni presenti in quell'ora
+  3) [C] [USCITA]  curricolari liberi perché la loro classe è in uscita
+  4) [C]           curricolari occupati in quell'ora
+  5) [S] [NP]      sostegni che non compaiono in orario in quell'ora
+  6) [C] [NP]      curricolari che non compaiono in orario in quell'ora
+
+Dentro ogni fascia l'ordine è alfabetico oppure, se si passa il carico
+(ore di sostituzione già svolte, dallo storico), prima chi ne ha fatte meno
+e a parità in ordine alfabetico: così le sostituzioni si distribuiscono
+invece di ricadere sempre sui primi dell'elenco.
+
+Quando nella stessa ora ci sono più classi scoperte, le proposte non si
+scelgono riga per riga: abbina_ora() risolve un abbinamento classi ↔
+docenti (assegnazione a costo minimo) che copre più classi possibile, poi
+preferisce le fasce migliori, senza mai proporre lo stesso docente due volte.
+Con i LimitiGiornata, pianifica_giornata() decide tutte le ore insieme
+rispettando anche il massimo di sostituzioni e di ore consecutive per docente.
+"""
+import hashlib
+import heapq
+import re
+import time
+import unicodedata
+from itertools import groupby
+from types import MappingProxyType
+from typing import NamedTuple
+
+import pandas as pd
+
+from abbinamento import INFINITO, assegnazione_minima, flusso_costo_minimo
+
+GIORNI_SETTIMANA = ["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì"]
+ORE_LEZIONE      = ["I", "II", "III", "IV", "V", "VI"]
+
+TRADUZIONE_GIORNI = {
+    0: "Lunedì", 1: "Martedì", 2: "Mercoledì", 3: "Giovedì",
+    4: "Venerdì", 5: "Sabato", 6: "Domenica",
+}
+
+PREFISSI_ETICHETTA = ("[S] [NP] ", "[C] [NP] ", "[C] [USCITA] ", "[S] ", "[C] ")
+
+
+class IndiceOrario(NamedTuple):
+    """Viste in sola lettura dell'orario, pronte per la Gestione Assenze.
+    Tutte le chiavi sono (Giorno, Ora) oppure (Giorno, Ora, Classe); le
+    righe con Escludi=True non compaiono tra i presenti.
+
+    Le maschere codificano l'orario settimanale di ogni docente in un intero:
+    il bit `bit_slot[(g, o)]` è 1 se in quell'ora ha lezione (anche nelle
+    righe Escludi). Le domande "è libero in quell'ora?" diventano operazioni
+    sui bit (vedi i candidati NP in costruisci_indice)."""
+    docenti: tuple                 # tutti i docenti, ordinati
+    esclusi: frozenset             # docenti con almeno una riga Escludi=True
+    tipo_docente: MappingProxyType # {docente: tipo} (primo Tipo non vuoto)
+    sostegni_slot: MappingProxyType         # (g, o)    -> docenti di sostegno presenti
+    sostegni_classe: MappingProxyType       # (g, o, c) -> docenti di sostegno in quella classe
+    curricolari_slot: MappingProxyType      # (g, o)    -> ((docente, classe), ...) curricolari presenti
+    np_sostegno_slot: MappingProxyType      # (g, o)    -> sostegni NON in orario in quell'ora
+    np_curricolari_slot: MappingProxyType   # (g, o)    -> curricolari NON in orario in quell'ora
+    np_sostegno_tutti: tuple       # NP per un'ora in cui nessuno ha lezione
+    np_curricolari_tutti: tuple
+    lezioni: pd.DataFrame                   # Docente, Giorno, Ora, Classe: prima lezione per slot
+    bit_slot: MappingProxyType              # (g, o)    -> posizione del bit dello slot
+    maschere_sostegno: MappingProxyType     # {docente: int} ore settimanali come sostegno
+    maschere_curricolari: MappingProxyType  # {docente: int} ore settimanali curricolari
+
+
+class OpzioniOra(NamedTuple):
+    """Una riga scoperta (ora, classe, assente) con i candidati in ordine
+    di priorità, già etichettati, e il sostituto proposto."""
+    ora: str
+    classe: str
+    assente: str
+    opzioni: tuple    # ("Nessuno", "[S] ...", ...)
+    proposto: str     # una delle opzioni, "Nessuno" se non c'è nessun candidato
+    fasce: tuple = () # fascia di priorità (0-5) di ogni opzione, None per "Nessuno"
+    motivo: str = ""  # perché la proposta è "Nessuno" (pianificazione della giornata)
+
+
+class VerificaConferma(NamedTuple):
+    """Esito del controllo di "Conferma tabella", pronto da mostrare."""
+    duplicati: pd.DataFrame  # Ora, Sostituto, Classi: stesso docente su più classi nella stessa ora
+    occupati: pd.DataFrame   # Ora, Classe, Sostituto, Lezione in: curricolare che ha già lezione
+
+    @property
+    def ok(self):
+        return self.duplicati.empty and self.occupati.empty
+
+
+class LimitiGiornata(NamedTuple):
+    """Vincoli della pianificazione dell'intera giornata, per docente."""
+    max_sostituzioni: int = 3  # sostituzioni nella stessa giornata
+    max_consecutive: int = 2   # ore di sostituzione una dopo l'altra
+
+
+class PianoSostituzioni(NamedTuple):
+    giorno: str
+    ore_assenti: pd.DataFrame  # righe dell'orario degli assenti, ordinate per Ora/Docente
+    righe: tuple               # OpzioniOra, nello stesso ordine di ore_assenti
+
+
+def giorno_della_data(data):
+    """Nome del giorno in italiano, indipendente dal locale del server."""
+    return TRADUZIONE_GIORNI[data.weekday()]
+
+
+def pulisci_etichetta(label):
+    """Toglie i prefissi [S]/[C]/[NP]/[USCITA] e restituisce il nome del docente."""
+    nome = label
+    for prefisso in PREFISSI_ETICHETTA:
+        nome = nome.replace(prefisso, "")
+    return nome.strip()
+
+
+def build_docente_tipo_map(df):
+    """Precalcola una mappa {docente: tipo} una sola volta, invece di
+    rifare un filtro su orario_df per ogni docente dentro i loop."""
+    if df.empty:
+        return {}
+    tmp = df[df["Tipo"].astype(str).str.strip() != ""]
+    if tmp.empty:
+        return {}
+    return tmp.groupby("Docente", observed=True)["Tipo"].first().to_dict()
+
+
+def _giorni_e_ore(df):
+    """Prima la settimana standard, poi eventuali giorni/ore fuori elenco presenti nel foglio."""
+    giorni = GIORNI_SETTIMANA + sorted(set(df["Giorno"]) - set(GIORNI_SETTIMANA))
+    ore = ORE_LEZIONE + sorted(set(df["Ora"]) - set(ORE_LEZIONE))
+    return giorni, ore
+
+
+def compatta_orario(df):
+    """Forma compatta dell'orario normalizzato: Giorno e Ora categoriali
+    ordinati come GIORNI_SETTIMANA/ORE_LEZIONE (eventuali valori fuori
+    elenco in coda), Docente, Classe e Tipo categoriali e la colonna
+    booleana is_sostegno. I filtri diventano confronti tra interi invece
+    che tra stringhe, e la memoria per sessione si riduce."""
+    df = df.copy()
+    df["is_sostegno"] = df["Tipo"].astype(str).str.lower() == "sostegno"
+    giorni, ore = _giorni_e_ore(df)
+    df["Giorno"] = pd.Categorical(df["Giorno"], categories=giorni, ordered=True)
+    df["Ora"] = pd.Categorical(df["Ora"], categories=ore, ordered=True)
+    for col in ["Docente", "Classe", "Tipo"]:
+        df[col] = df[col].astype("category")
+    return df
+
+
+def righe_sostegno(df):
+    """Maschera delle righe di sostegno: la colonna precalcolata se l'orario
+    è in forma compatta, altrimenti il confronto sul Tipo."""
+    if "is_sostegno" in df.columns:
+        return df["is_sostegno"]
+    return df["Tipo"].astype(str).str.lower() == "sostegno"
+
+
+def versione_orario(df):
+    """Impronta del contenuto dell'orario: cambia solo se cambiano i dati,
+    così le strutture derivate si ricalcolano una volta per versione."""
+    if df.empty:
+        return "vuoto"
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()
+
+
+def costruisci_indice(df):
+    """Costruisce l'IndiceOrario a partire da un orario normalizzato
+    (colonne Docente, Giorno, Ora, Classe, Tipo, Escludi)."""
+    docenti = tuple(sorted(df["Docente"].unique()))
+    esclusi = frozenset(df.loc[df["Escludi"], "Docente"].unique())
+    tipo_docente = build_docente_tipo_map(df)
+
+    attivi = df[~df["Escludi"]]
+    is_sostegno = righe_sostegno(attivi)
+
+    sostegni_slot = _tuple_per_chiave(attivi.loc[is_sostegno], ["Giorno", "Ora"], ["Docente"])
+    sostegni_classe = _tuple_per_chiave(attivi.loc[is_sostegno], ["Giorno", "Ora", "Classe"], ["Docente"])
+    curricolari_slot = _tuple_per_chiave(attivi.loc[~is_sostegno], ["Giorno", "Ora"], ["Docente", "Classe"])
+
+    # Un bit per ogni (Giorno, Ora): prima la settimana standard, poi
+    # eventuali giorni/ore fuori elenco presenti nel foglio
+    giorni, ore = _giorni_e_ore(df)
+    bit_slot = {(g, o): i * len(ore) + j for i, g in enumerate(giorni) for j, o in enumerate(ore)}
+    sostegno = righe_sostegno(df)
+    maschere_sostegno = _maschere(df[sostegno], bit_slot)
+    maschere_curricolari = _maschere(df[~sostegno], bit_slot)
+
+    # Candidati NP: chi non ha lezione in quell'ora e non è escluso (gli
+    # esclusi non sono mai NP, quindi conta anche l'orario con Escludi).
+    # Gli assenti del giorno si tolgono al momento della richiesta.
+    candidati_np = [d for d in docenti if d not in esclusi]
+    np_s = [d for d in candidati_np if tipo_docente.get(d, "").lower() == "sostegno"]
+    np_c = [d for d in candidati_np if tipo_docente.get(d, "").lower() != "sostegno"]
+    occupato = {
+        d: maschere_sostegno.get(d, 0) | maschere_curricolari.get(d, 0) for d in candidati_np
+    }
+    np_sostegno_slot, np_curricolari_slot = {}, {}
+    for slot, posizione in bit_slot.items():
+        bit = 1 << posizione
+        np_sostegno_slot[slot] = tuple(d for d in np_s if not occupato[d] & bit)
+        np_curricolari_slot[slot] = tuple(d for d in np_c if not occupato[d] & bit)
+    np_sostegno_tutti, np_curricolari_tutti = tuple(np_s), tuple(np_c)
+
+    return IndiceOrario(
+        docenti=docenti,
+        esclusi=esclusi,
+        tipo_docente=MappingProxyType(tipo_docente),
+        sostegni_slot=MappingProxyType(sostegni_slot),
+        sostegni_classe=MappingProxyType(sostegni_classe),
+        curricolari_slot=MappingProxyType(curricolari_slot),
+        np_sostegno_slot=MappingProxyType(np_sostegno_slot),
+        np_curricolari_slot=MappingProxyType(np_curricolari_slot),
+        np_sostegno_tutti=np_sostegno_tutti,
+        np_curricolari_tutti=np_curricolari_tutti,
+        lezioni=df[["Docente", "Giorno", "Ora", "Classe"]]
+            .drop_duplicates(["Docente", "Giorno", "Ora"])
+            .reset_index(drop=True),
+        bit_slot=MappingProxyType(bit_slot),
+        maschere_sostegno=MappingProxyType(maschere_sostegno),
+        maschere_curricolari=MappingProxyType(maschere_curricolari),
+    )
+
+
+def _tuple_per_chiave(df, chiave, valori):
+    """{chiave: tupla ordinata e senza doppioni dei valori} in una sola
+    passata sulle colonne (con più colonne di valori, tuple di tuple)."""
+    righe = df[chiave + valori].drop_duplicates()
+    n = len(chiave)
+    gruppi = {}
+    for riga in zip(*(righe[c].tolist() for c in chiave + valori)):
+        gruppi.setdefault(riga[:n], []).append(riga[n] if len(valori) == 1 else riga[n:])
+    return {k: tuple(sorted(v)) for k, v in gruppi.items()}
+
+
+def _maschere(df, bit_slot):
+    """{docente: intero con un bit acceso per ogni ora di lezione}."""
+    if df.empty:
+        return {}
+    bit = pd.Series(
+        [1 << bit_slot[k] for k in zip(df["Giorno"], df["Ora"])], index=df.index, dtype=object
+    )
+    # un docente può comparire più volte nello stesso slot: prima si tolgono i doppioni
+    coppie = pd.DataFrame({"Docente": df["Docente"], "bit": bit}).drop_duplicates()
+    return coppie.groupby("Docente", observed=True)["bit"].sum().to_dict()
+
+
+def sostegni_in_servizio(df):
+    """Tabella Giorno, Ora, Classe → "Sostegni in servizio" (nomi ordinati,
+    separati da virgola) con tutte le righe di sostegno dell'orario, anche
+    quelle Escludi: serve solo a mostrare chi è in classe."""
+    sostegni = df.loc[righe_sostegno(df), ["Giorno", "Ora", "Classe", "Docente"]].astype({"Docente": str})
+    return (
+        sostegni.drop_duplicates()
+        .sort_values("Docente")
+        .groupby(["Giorno", "Ora", "Classe"], sort=False, observed=True)["Docente"]
+        .agg(", ".join)
+        .rename("Sostegni in servizio")
+        .reset_index()
+    )
+
+
+def _ordine_classe(classe):
+    """Chiave di ordinamento "1A, 1B, 2A, ..., 10A", poi le classi senza numero."""
+    m = re.match(r"(\d+)\s*([A-Za-zÀ-ÖØ-öø-ÿ]+)", str(classe))
+    if m:
+        return (int(m.group(1)), m.group(2).upper())
+    return (10**9, str(classe))
+
+
+def costruisci_pivot_docenti(df):
+    """Ora × Giorno con "Docente (Classe)" separati da " / " ([S] per i sostegni)."""
+    info = df["Docente"].astype(str) + " (" + df["Classe"].astype(str) + ")"
+    info = info.where(~df["Tipo"].astype(str).str.contains("Sostegno", regex=False), "[S] " + info)
+    return info.groupby([df["Ora"], df["Giorno"]], observed=True).agg(" / ".join).unstack("Giorno").fillna("")
+
+
+def celle_per_classe(df):
+    """(Giorno, Ora) × Classe: in ogni cella la tupla ((docente, è_sostegno), ...)
+    nell'ordine dell'orario, senza doppioni; NaN se la classe non ha lezione."""
+    chiave = ["Giorno", "Ora", "Classe", "Docente"]
+    # è sostegno in quella cella se lo è almeno una delle sue righe
+    sostegno = righe_sostegno(df).groupby([df[c] for c in chiave], observed=True).transform("any")
+    primo = ~df.duplicated(chiave)
+    righe = df[primo]
+    coppie = pd.Series(list(zip(righe["Docente"], sostegno[primo])), index=righe.index, dtype=object)
+    celle = (
+        coppie.groupby([righe["Giorno"], righe["Ora"], righe["Classe"]], sort=False, observed=True)
+        .agg(tuple)
+        .unstack("Classe")
+    )
+    return celle.reindex(columns=pd.Index(sorted(celle.columns, key=_ordine_classe), dtype=object, name="Classe"))
+
+
+def formatta_vista_classi(testi):
+    """Da (Giorno, Ora) × Classe di testi a tabella da mostrare: "-" per le
+    ore senza lezione, il giorno solo sulla prima ora e una riga "──" tra
+    un giorno e l'altro."""
+    pivot = testi.fillna("-").reindex(
+        pd.MultiIndex.from_product([GIORNI_SETTIMANA, ORE_LEZIONE], names=["Giorno", "Ora"])
+    ).reset_index()
+    # Giorno e Ora arrivano categoriali dall'orario compatto: come testo si
+    # possono svuotare e affiancare ai separatori
+    pivot[["Giorno", "Ora"]] = pivot[["Giorno", "Ora"]].astype(str)
+    primo = ~pivot["Giorno"].duplicated()
+    pivot["Giorno"] = pivot["Giorno"].where(primo, "")
+    # separatori a metà tra l'ultima ora di un giorno e la prima del successivo
+    separatori = pd.DataFrame("", index=pivot.index[primo][1:] - 0.5, columns=pivot.columns)
+    separatori["Giorno"] = "──"
+    return pd.concat([pivot, separatori]).sort_index().reset_index(drop=True)
+
+
+def vista_classi(celle):
+    """La vista "classi" con tutti i docenti, da celle_per_classe."""
+    return formatta_vista_classi(celle.map(lambda t: " / ".join(d for d, _ in t) if isinstance(t, tuple) else t))
+
+
+def classi_per_docente(df):
+    """Docente -> tupla delle sue classi, nell'ordine dell'orario."""
+    return df.groupby("Docente", observed=True)["Classe"].agg(lambda c: tuple(c.unique())).to_dict()
+
+
+def vista_classi_filtrata(celle, classi_docente, docenti):
+    """Le colonne delle classi dei docenti scelti, con nelle celle solo loro
+    e i sostegni in compresenza (le ore in cui non ci sono restano "-").
+    Nella cella vengono prima i docenti scelti e poi gli altri sostegni,
+    ciascun gruppo nell'ordine dell'orario, come nella vista per classi
+    costruita dalle sole righe filtrate."""
+    scelti = frozenset(docenti)
+    classi = {c for d in docenti for c in classi_docente.get(d, ())}
+    celle = celle.loc[:, [c for c in celle.columns if c in classi]]
+
+    def testo(cella):
+        if not isinstance(cella, tuple) or scelti.isdisjoint(d for d, _ in cella):
+            return None
+        nomi = [d for d, _ in cella if d in scelti]
+        nomi += [d for d, sostegno in cella if sostegno and d not in scelti]
+        return " / ".join(nomi)
+
+    testi = celle.map(testo)
+    return formatta_vista_classi(testi.loc[:, testi.notna().any()].dropna(how="all"))
+
+
+def normalizza_docente(nome):
+    """Nome confrontabile tra orari diversi (es. due plessi): senza accenti,
+    maiuscole/minuscole e spazi in più."""
+    testo = unicodedata.normalize("NFKD", str(nome))
+    return " ".join("".join(c for c in testo if not unicodedata.combining(c)).casefold().split())
+
+
+def impegnati_altrove(indice, impegni):
+    """Incrocia i docenti di questo orario con gli impegni di un altro
+    ({docente normalizzato: {(giorno, ora): plesso}}) e restituisce
+    {(giorno, ora): {docente come scritto qui: plesso}}."""
+    per_slot = {}
+    for docente in indice.docenti:
+        for slot, plesso in impegni.get(normalizza_docente(docente), {}).items():
+            per_slot.setdefault(slot, {})[docente] = plesso
+    return per_slot
+
+
+def carico_per_docente(indice, carico):
+    """{docente dell'orario: ore già svolte} a partire dai totali dello
+    storico, che hanno i nomi in minuscolo."""
+    return {d: carico.get(d.strip().lower(), 0) for d in indice.docenti}
+
+
+def opzioni_sostituto(indice, giorno, ora, classe, assente, assenti, classi_uscita_ora=frozenset(),
+                      carico=None, impegnati_altrove=frozenset()):
+    """Lista ordinata dei candidati per una singola ora scoperta.
+
+    `assenti` sono TUTTI i docenti assenti del giorno: nessuno di loro può
+    comparire come sostituto, in nessuna ora. `carico` ({docente: ore},
+    vedi carico_per_docente) ordina ogni fascia da chi ha fatto meno ore.
+    `impegnati_altrove` sono i docenti che in quell'ora hanno lezione in un
+    altro plesso: liberi qui, ma non proponibili come [NP]."""
+    slot = (giorno, ora)
+
+    def disponibili(docenti):
+        liberi = [d for d in docenti if d not in assenti and d != assente]
+        if carico:
+            # sort stabile: a parità di ore resta l'ordine alfabetico
+            liberi.sort(key=carico.get)
+        return liberi
+
+    same_class_sost = disponibili(indice.sostegni_classe.get((giorno, ora, classe), ()))
+    other_sost = disponibili(indice.sostegni_slot.get(slot, ()))
+    curricolari_presenti = [
+        (d, c) for d, c in indice.curricolari_slot.get(slot, ())
+        if d not in assenti and d != assente
+    ]
+    curricolari_liberi_uscita = list(dict.fromkeys(
+        d for d, c in curricolari_presenti if c in classi_uscita_ora
+    ))
+    curricolari_occupati = list(dict.fromkeys(
+        d for d, c in curricolari_presenti if c not in classi_uscita_ora
+    ))
+    if carico:
+        curricolari_liberi_uscita.sort(key=carico.get)
+        curricolari_occupati.sort(key=carico.get)
+    np_sost = [
+        d for d in disponibili(indice.np_sostegno_slot.get(slot, indice.np_sostegno_tutti))
+        if d not in impegnati_altrove
+    ]
+    np_curr = [
+        d for d in disponibili(indice.np_curricolari_slot.get(slot, indice.np_curricolari_tutti))
+        if d not in impegnati_altrove
+    ]
+
+    fasce = (
+        ("[S] ", same_class_sost),
+        ("[S] ", other_sost),
+        ("[C] [USCITA] ", curricolari_liberi_uscita),
+        ("[C] ", curricolari_occupati),
+        ("[S] [NP] ", np_sost),
+        ("[C] [NP] ", np_curr),
+    )
+
+    added = set()
+    options = ["Nessuno"]
+    fasce_opzioni = [None]
+    for fascia, (prefisso, docenti) in enumerate(fasce):
+        for d in docenti:
+            if d in added:
+                continue
+            options.append(f"{prefisso}{d}"); added.add(d)
+            fasce_opzioni.append(fascia)
+
+    # Proposta: il primo (meno carico, poi alfabetico) della fascia migliore non vuota;
+    # con più classi scoperte nella stessa ora la rivede abbina_ora()
+    proposto = "Nessuno"
+    for prefisso, docenti in fasce:
+        if docenti:
+            proposto = f"{prefisso}{docenti[0]}"
+            break
+
+    return OpzioniOra(ora, classe, assente, tuple(options), proposto, tuple(fasce_opzioni))
+
+
+def _candidati_migliori(righe, quanti):
+    """Per ogni riga i primi `quanti` candidati: (nome, etichetta, fascia,
+    posizione nella fascia). Bastano i primi n con n righe da coprire: se
+    la soluzione ottima ne usasse uno peggiore, almeno uno dei primi n non
+    sarebbe usato da nessun'altra riga (sono n-1) e costerebbe meno o uguale."""
+    candidati = []
+    for riga in righe:
+        per_riga, posizione, fascia_prec = [], 0, None
+        for etichetta, fascia in zip(riga.opzioni[1:], riga.fasce[1:]):
+            posizione = posizione + 1 if fascia == fascia_prec else 0
+            fascia_prec = fascia
+            per_riga.append((pulisci_etichetta(etichetta), etichetta, fascia, posizione))
+            if len(per_riga) == quanti:
+                break
+        candidati.append(per_riga)
+    return candidati
+
+
+def _pesi(candidati):
+    """(peso di una fascia, costo di "Nessuno"): la fascia conta più di
+    qualunque somma di posizioni, "Nessuno" più di qualunque abbinamento."""
+    n = len(candidati)
+    peso_fascia = n * (max((c[3] for cs in candidati for c in cs), default=0) + 1)
+    return peso_fascia, n * 6 * peso_fascia + 1
+
+
+def abbina_ora(righe):
+    """Proposte senza conflitti per le righe scoperte di UNA stessa ora.
+
+    Abbinamento righe ↔ docenti a costo minimo: il costo di un candidato è
+    la sua fascia (pesata in modo da contare più di qualunque somma di
+    posizioni) più la posizione dentro la fascia; "Nessuno" costa più di
+    qualunque abbinamento, così prima si coprono più classi possibile, poi
+    si scelgono le fasce migliori. Restituisce le righe con `proposto`
+    aggiornato, nello stesso ordine."""
+    n = len(righe)
+    if n <= 1:
+        return tuple(righe)
+
+    candidati = _candidati_migliori(righe, n)
+    peso_fascia, costo_nessuno = _pesi(candidati)
+    colonne = list(dict.fromkeys(nome for cs in candidati for nome, *_ in cs))
+    indice_colonna = {nome: j for j, nome in enumerate(colonne)}
+
+    costi = []
+    for cs in candidati:
+        riga_costi = [INFINITO] * len(colonne) + [costo_nessuno] * n
+        for nome, _, fascia, posizione in cs:
+            riga_costi[indice_colonna[nome]] = fascia * peso_fascia + posizione
+        costi.append(riga_costi)
+
+    abbinate = []
+    for riga, cs, j in zip(righe, candidati, assegnazione_minima(costi)):
+        etichette = {nome: etichetta for nome, etichetta, *_ in cs}
+        proposto = etichette[colonne[j]] if j < len(colonne) else "Nessuno"
+        abbinate.append(riga._replace(proposto=proposto))
+    return tuple(abbinate)
+
+
+# Oltre questi limiti la ricerca esatta si ferma e si ripiega sull'euristica
+MAX_NODI_GIORNATA = 200    # soluzioni del flusso esplorate
+TEMPO_MAX_GIORNATA_S = 0.3  # in tutto, euristica compresa
+QUOTA_RICERCA_ESATTA = 0.6  # parte del tempo per la ricerca esatta, il resto all'euristica
+
+
+def _risolvi_giornata(righe, candidati, docenti, pesi, limiti, vietati):
+    """Un flusso a costo minimo sorgente → riga → (docente, ora) → docente → pozzo,
+    senza le coppie (docente, ora) `vietati`. Restituisce (costo totale,
+    {riga: docente}, {(riga, docente): costo})."""
+    peso_fascia, costo_nessuno = pesi
+    n = len(righe)
+    sorgente, pozzo = 0, 1
+    nodo_docente = {d: 2 + i for i, d in enumerate(docenti)}
+    primo_libero = 2 + len(docenti)
+    slot = {}
+    archi = []
+    scelte = []  # (indice arco, riga, docente)
+    for i, (riga, cs) in enumerate(zip(righe, candidati)):
+        nodo_riga = primo_libero
+        primo_libero += 1
+        archi.append((sorgente, nodo_riga, 1, 0))
+        archi.append((nodo_riga, pozzo, 1, costo_nessuno))
+        for nome, _, fascia, posizione in cs:
+            if (nome, riga.ora) in vietati:
+                continue
+            if (nome, riga.ora) not in slot:
+                slot[(nome, riga.ora)] = primo_libero
+                archi.append((primo_libero, nodo_docente[nome], 1, 0))
+                primo_libero += 1
+            scelte.append((len(archi), i, nome))
+            archi.append((nodo_riga, slot[(nome, riga.ora)], 1, fascia * peso_fascia + posizione))
+    for nome in docenti:
+        archi.append((nodo_docente[nome], pozzo, limiti.max_sostituzioni, 0))
+
+    flusso = flusso_costo_minimo(primo_libero, archi, sorgente, pozzo, n)
+    costo_totale = sum(f * arco[3] for f, arco in zip(flusso, archi))
+    assegnati = {i: nome for a, i, nome in scelte if flusso[a]}
+    costo_scelta = {(i, nome): archi[a][3] for a, i, nome in scelte}
+    return costo_totale, assegnati, costo_scelta
+
+
+def _violazioni(righe, assegnati, limiti, ore):
+    """Finestre di max_consecutive+1 ore di fila (nell'ordine di `ore`)
+    assegnate allo stesso docente, ognuna come lista di (docente, ora):
+    per ogni docente dalla prima ora, senza sovrapposizioni."""
+    posizione_ora = {o: k for k, o in enumerate(ore)}
+    ore_per_docente = {}
+    for i, nome in assegnati.items():
+        ore_per_docente.setdefault(nome, set()).add(posizione_ora[righe[i].ora])
+    finestra = limiti.max_consecutive + 1
+    for nome in sorted(ore_per_docente):
+        posizioni = ore_per_docente[nome]
+        libera_da = -1
+        for inizio in sorted(posizioni):
+            if inizio >= libera_da and all(inizio + k in posizioni for k in range(finestra)):
+                yield [(nome, ore[inizio + k]) for k in range(finestra)]
+                libera_da = inizio + finestra
+
+
+def _prima_violazione(righe, assegnati, limiti, ore):
+    """Prima finestra di ore di fila oltre il limite (vedi _violazioni);
+    None se il limite è rispettato."""
+    return next(_violazioni(righe, assegnati, limiti, ore), None)
+
+
+def pianifica_giornata(righe, limiti, ore=ORE_LEZIONE):
+    """Proposte per TUTTE le righe scoperte della giornata insieme.
+
+    Flusso a costo minimo: ogni riga riceve al più un docente, ogni docente
+    al più una classe per ora e al più `limiti.max_sostituzioni` nella
+    giornata; "Nessuno" è l'alternativa con il costo più alto, quindi si
+    coprono prima più classi possibile e poi si scelgono le fasce migliori.
+
+    Il limite di ore consecutive non è esprimibile come flusso: se la
+    soluzione lo supera, almeno una coppia (docente, ora) della finestra
+    troppo lunga va esclusa, e si esplorano le alternative dalla meno
+    costosa (branch and bound: la prima soluzione valida estratta è ottima).
+    Oltre MAX_NODI_GIORNATA soluzioni (o TEMPO_MAX_GIORNATA_S secondi) si
+    ripiega su un'euristica che esclude, in ogni finestra troppo lunga,
+    l'abbinamento più costoso e risolve di nuovo. Anche l'euristica rispetta
+    TEMPO_MAX_GIORNATA_S (un flusso parte solo se c'è il tempo di finirlo):
+    a tempo scaduto gli abbinamenti di troppo si tolgono direttamente dalla
+    soluzione, senza altri flussi, e le righe rimaste libere prendono il
+    primo candidato che non supera i limiti (vedi _riempi_righe_libere).
+
+    `ore` è l'ordine delle ore della giornata, comprese quelle fuori
+    ORE_LEZIONE presenti nell'orario (vedi _giorni_e_ore). Le righe rimaste
+    a "Nessuno" ricevono in `motivo` la spiegazione."""
+    n = len(righe)
+    if n == 0:
+        return ()
+    candidati = _candidati_migliori(righe, n)
+    pesi = _pesi(candidati)
+    docenti = list(dict.fromkeys(nome for cs in candidati for nome, *_ in cs))
+
+    durata_flusso = 0.0  # il flusso più lento finora: se non sta nel tempo rimasto non si avvia
+
+    def risolvi(vietati):
+        nonlocal durata_flusso
+        avvio = time.perf_counter()
+        costo, assegnati, costo_scelta = _risolvi_giornata(righe, candidati, docenti, pesi, limiti, vietati)
+        durata_flusso = max(durata_flusso, time.perf_counter() - avvio)
+        return costo, assegnati, costo_scelta, _prima_violazione(righe, assegnati, limiti, ore)
+
+    def c_e_tempo(limite):
+        return time.perf_counter() + durata_flusso < limite
+
+    radice = frozenset()
+    costo, assegnati, costo_scelta, violazione = risolvi(radice)
+    aperti = [(costo, 0, radice, assegnati, costo_scelta, violazione)]
+    visti = {radice}
+    esplorati = 0
+    soluzione = None
+    inizio = time.perf_counter()
+    scadenza_esatta = inizio + TEMPO_MAX_GIORNATA_S * QUOTA_RICERCA_ESATTA
+    scadenza = inizio + TEMPO_MAX_GIORNATA_S
+    while aperti and esplorati < MAX_NODI_GIORNATA and c_e_tempo(scadenza_esatta):
+        _, _, vietati, assegnati, costo_scelta, violazione = heapq.heappop(aperti)
+        if violazione is None:
+            soluzione = (vietati, assegnati)
+            break
+        for coppia in violazione:
+            figlio = vietati | {coppia}
+            if figlio in visti:
+                continue
+            visti.add(figlio)
+            esplorati += 1
+            costo, assegnati_f, costo_scelta_f, violazione_f = risolvi(figlio)
+            heapq.heappush(aperti, (costo, esplorati, figlio, assegnati_f, costo_scelta_f, violazione_f))
+
+    if soluzione is None:
+        # troppe alternative: dalla migliore aperta, si esclude la coppia più
+        # costosa di ogni finestra troppo lunga finché il limite è rispettato
+        _, _, vietati, assegnati, costo_scelta, violazione = min(aperti)
+
+        def peggiore(finestra):
+            return max(finestra, key=lambda c: costo_scelta[(_riga_di(assegnati, righe, c), c[0])])
+
+        while violazione is not None and c_e_tempo(scadenza):
+            vietati = vietati | {peggiore(f) for f in _violazioni(righe, assegnati, limiti, ore)}
+            _, assegnati, costo_scelta, violazione = risolvi(vietati)
+        # tempo scaduto: niente più flussi, si tolgono gli abbinamenti di troppo
+        # e le righe rimaste libere si riempiono dove i limiti lo permettono
+        assegnati = dict(assegnati)
+        while violazione is not None:
+            coppia = peggiore(violazione)
+            del assegnati[_riga_di(assegnati, righe, coppia)]
+            vietati = vietati | {coppia}
+            violazione = _prima_violazione(righe, assegnati, limiti, ore)
+        _riempi_righe_libere(righe, candidati, assegnati, limiti, ore)
+        soluzione = (vietati, assegnati)
+
+    vietati, assegnati = soluzione
+    pianificate = []
+    for i, (riga, cs) in enumerate(zip(righe, candidati)):
+        if i in assegnati:
+            etichette = {nome: etichetta for nome, etichetta, *_ in cs}
+            pianificate.append(riga._replace(proposto=etichette[assegnati[i]], motivo=""))
+        else:
+            pianificate.append(riga._replace(
+                proposto="Nessuno", motivo=_motivo_nessuno(riga, assegnati, righe, limiti, vietati),
+            ))
+    return tuple(pianificate)
+
+
+def _riempi_righe_libere(righe, candidati, assegnati, limiti, ore):
+    """Assegna alle righe senza docente il primo candidato (nell'ordine di
+    priorità) libero in quell'ora, sotto il massimo giornaliero e senza
+    superare le ore di fila. Modifica `assegnati` sul posto."""
+    for i, cs in enumerate(candidati):
+        if i in assegnati:
+            continue
+        for nome, *_ in cs:
+            impegni = [righe[j].ora for j, d in assegnati.items() if d == nome]
+            if righe[i].ora in impegni or len(impegni) >= limiti.max_sostituzioni:
+                continue
+            assegnati[i] = nome
+            if _prima_violazione(righe, assegnati, limiti, ore) is None:
+                break
+            del assegnati[i]
+
+
+def _riga_di(assegnati, righe, coppia):
+    """Indice della riga assegnata al docente nell'ora della coppia (docente, ora)."""
+    nome, ora = coppia
+    return next(i for i, d in assegnati.items() if d == nome and righe[i].ora == ora)
+
+
+def _motivo_nessuno(riga, assegnati, righe, limiti, vietati):
+    """Spiega perché nessun candidato della riga è stato proposto."""
+    candidati = [pulisci_etichetta(e) for e in riga.opzioni[1:]]
+    if not candidati:
+        return "nessun docente disponibile in quest'ora"
+    impegno = {}
+    for i, nome in assegnati.items():
+        impegno.setdefault(nome, []).append(righe[i].ora)
+    occupati = al_limite = consecutive = 0
+    for nome in candidati:
+        ore = impegno.get(nome, [])
+        if riga.ora in ore:
+            occupati += 1
+        elif len(ore) >= limiti.max_sostituzioni:
+            al_limite += 1
+        else:
+            consecutive += 1
+    parti = []
+    if occupati:
+        parti.append(f"{occupati} già in sostituzione in un'altra classe in quest'ora")
+    if al_limite:
+        parti.append(f"{al_limite} al limite di {limiti.max_sostituzioni} sostituzioni nella giornata")
+    if consecutive:
+        parti.append(f"{consecutive} oltre il limite di {limiti.max_consecutive} ore di sostituzione di fila")
+    return "tutti i candidati sono impegnati: " + ", ".join(parti)
+
+
+def pianifica_sostituzioni(orario_df, data, docenti_assenti, classi_uscita_per_ora, indice=None,
+                           carico=None, limiti=None, altrove=None):
+    """Punto di ingresso del motore: dato l'orario, la data, gli assenti e
+    le classi in uscita {ora: set(classi)} restituisce un PianoSostituzioni
+    con le ore scoperte e, per ognuna, opzioni e proposta.
+
+    Se `indice` è già disponibile (cache per versione dell'orario) viene
+    riusato, altrimenti viene costruito al volo. `carico` sono le ore di
+    sostituzione già svolte {docente in minuscolo: ore}, come nello storico.
+    Con `limiti` (LimitiGiornata) le proposte si decidono per l'intera
+    giornata; senza, ora per ora. `altrove` ({(giorno, ora): docenti}, vedi
+    impegnati_altrove) toglie dai [NP] chi in quell'ora è in un altro plesso."""
+    giorno = giorno_della_data(data)
+    assenti = frozenset(docenti_assenti)
+
+    ore_assenti = orario_df[
+        (orario_df["Docente"].isin(assenti)) &
+        (orario_df["Giorno"] == giorno)
+    ].copy()
+    if ore_assenti.empty:
+        return PianoSostituzioni(giorno, ore_assenti, ())
+
+    if indice is None:
+        indice = costruisci_indice(orario_df)
+
+    # Ordino per ora (I → VI) in modo che tutte le I ore compaiano insieme,
+    # poi le II, ecc. — indipendentemente dall'ordine di selezione degli assenti.
+    # Le ore fuori elenco presenti nel foglio (es. "VII") vanno in coda, come
+    # nell'indice, invece di diventare NaN.
+    _, ore = _giorni_e_ore(orario_df)
+    ore_assenti["Ora"] = pd.Categorical(ore_assenti["Ora"], categories=ore, ordered=True)
+    ore_assenti = ore_assenti.sort_values(["Ora", "Docente"]).reset_index(drop=True)
+
+    carico_docenti = carico_per_docente(indice, carico) if carico else None
+    righe = [
+        opzioni_sostituto(
+            indice, giorno, ora, classe, assente, assenti,
+            frozenset(classi_uscita_per_ora.get(ora, ())), carico_docenti,
+            (altrove or {}).get((giorno, ora), frozenset()),
+        )
+        for ora, classe, assente in zip(
+            ore_assenti["Ora"].astype(str), ore_assenti["Classe"], ore_assenti["Docente"]
+        )
+    ]
+    if limiti is not None:
+        righe = pianifica_giornata(righe, limiti, ore)
+    else:
+        # le righe sono già raggruppate per ora: un abbinamento per ciascuna
+        righe = tuple(
+            riga
+            for _, righe_ora in groupby(righe, key=lambda r: r.ora)
+            for riga in abbina_ora(list(righe_ora))
+        )
+    return PianoSostituzioni(giorno, ore_assenti, righe)
+
+
+NON_SOSTITUITO = ("Nessuno", "", "—")
+
+
+def verifica_conferma(sostituzioni_df, indice, giorno, classi_uscita_per_ora):
+    """Controlla le scelte della tabella (colonne Ora, Classe, Sostituto):
+      - lo stesso docente su più classi nella stessa ora;
+      - un docente curricolare che in quell'ora ha già lezione, a meno che
+        la sua classe non sia in uscita didattica.
+    Una groupby e una merge con le lezioni del giorno, nessun ciclo sulle righe."""
+    scelte = sostituzioni_df.loc[
+        ~sostituzioni_df["Sostituto"].isin(NON_SOSTITUITO), ["Ora", "Classe", "Sostituto"]
+    ].astype({"Ora": str})
+
+    per_docente = scelte.groupby(["Ora", "Sostituto"], sort=False)["Classe"]
+    duplicati = per_docente.agg(list).reset_index(name="Classi")
+    duplicati = duplicati[per_docente.size().to_numpy() > 1].reset_index(drop=True)
+
+    tipi = scelte["Sostituto"].map(indice.tipo_docente).fillna("").str.lower()
+    lezioni = indice.lezioni.loc[indice.lezioni["Giorno"] == giorno, ["Docente", "Ora", "Classe"]]
+    occupati = (
+        scelte[tipi != "sostegno"]
+        .drop_duplicates(["Ora", "Sostituto"])
+        .merge(
+            lezioni.rename(columns={"Docente": "Sostituto", "Classe": "Lezione in"}),
+            on=["Ora", "Sostituto"], how="inner",
+        )
+    )
+    in_uscita = pd.MultiIndex.from_tuples(
+        [(ora, c) for ora, classi in classi_uscita_per_ora.items() for c in classi],
+        names=["Ora", "Lezione in"],
+    )
+    occupati = occupati[
+        ~pd.MultiIndex.from_frame(occupati[["Ora", "Lezione in"]]).isin(in_uscita)
+    ].reset_index(drop=True)
+
+    return VerificaConferma(duplicati, occupati)
+
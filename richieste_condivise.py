@@ -0,0 +1,86 @@
+"""Richieste condivise ("single-flight") per le letture da Google.
+
+Se più sessioni chiedono lo stesso foglio mentre una lettura è già in
+corso, non ne parte una seconda: aspettano quella in volo e ne ricevono
+lo stesso risultato. Tiene anche i contatori per chiave (richieste
+effettive, richieste condivise, tempo passato in attesa) da mostrare
+nella pagina di diagnostica.
+"""
+import threading
+import time
+from collections import defaultdict
+
+
+class _Chiamata:
+    __slots__ = ("evento", "risultato", "errore")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.risultato = None
+        self.errore = None
+
+
+class VoloSingolo:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_volo = {}
+        self._contatori = defaultdict(lambda: {
+            "richieste": 0, "condivise": 0, "attesa_totale_s": 0.0, "attesa_max_s": 0.0,
+        })
+
+    def esegui_gruppo(self, chiavi, funzione):
+        """Restituisce {chiave: risultato} per tutte le `chiavi`.
+
+        Le chiavi già in volo vengono attese; per le altre si chiama UNA
+        volta `funzione(chiavi_mancanti)`, che deve restituire un dizionario
+        {chiave: risultato} (es. una sola batchGet per più fogli). Se la
+        funzione solleva un'eccezione, la ricevono tutti quelli in attesa."""
+        mie, altrui = {}, {}
+        with self._lock:
+            for chiave in dict.fromkeys(chiavi):
+                chiamata = self._in_volo.get(chiave)
+                if chiamata is None:
+                    mie[chiave] = self._in_volo[chiave] = _Chiamata()
+                else:
+                    altrui[chiave] = chiamata
+
+        if mie:
+            try:
+                risultati = funzione(list(mie))
+                for chiave, chiamata in mie.items():
+                    chiamata.risultato = risultati.get(chiave)
+            except BaseException as e:
+                for chiamata in mie.values():
+                    chiamata.errore = e
+            finally:
+                with self._lock:
+                    for chiave, chiamata in mie.items():
+                        del self._in_volo[chiave]
+                        self._contatori[chiave]["richieste"] += 1
+                for chiamata in mie.values():
+                    chiamata.evento.set()
+
+        for chiave, chiamata in altrui.items():
+            inizio = time.perf_counter()
+            chiamata.evento.wait()
+            attesa = time.perf_counter() - inizio
+            with self._lock:
+                c = self._contatori[chiave]
+                c["condivise"] += 1
+                c["attesa_totale_s"] += attesa
+                c["attesa_max_s"] = max(c["attesa_max_s"], attesa)
+
+        tutte = {**mie, **altrui}
+        for chiamata in tutte.values():
+            if chiamata.errore is not None:
+                raise chiamata.errore
+        return {chiave: chiamata.risultato for chiave, chiamata in tutte.items()}
+
+    def esegui(self, chiave, funzione):
+        """Come esegui_gruppo per una sola chiave: `funzione()` senza argomenti."""
+        return self.esegui_gruppo([chiave], lambda _: {chiave: funzione()})[chiave]
+
+    def contatori(self):
+        """Copia dei contatori: {chiave: {richieste, condivise, attesa_totale_s, attesa_max_s}}."""
+        with self._lock:
+            return {chiave: dict(c) for chiave, c in self._contatori.items()}